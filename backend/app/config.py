@@ -5,11 +5,86 @@ load_dotenv()
 
 class Settings:
     GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
+    GEMINI_MODELS: list = [
+        model.strip()
+        for model in os.getenv(
+            "GEMINI_MODELS", "gemini-2.5-flash,gemini-2.0-flash-exp,gemini-1.5-flash,gemini-1.5-pro"
+        ).split(",")
+        if model.strip()
+    ]  # Models requests may be routed to, in order of preference
+    GEMINI_HEDGE_DELAY: float = float(os.getenv("GEMINI_HEDGE_DELAY", "0"))  # Seconds before a hedged retry; 0 = off
+    GEMINI_CIRCUIT_FAILURES: int = int(os.getenv("GEMINI_CIRCUIT_FAILURES", "3"))  # Consecutive failures that open a circuit
+    GEMINI_CIRCUIT_OPEN_SECONDS: int = int(os.getenv("GEMINI_CIRCUIT_OPEN_SECONDS", "30"))
+    
+    # Gemini quota, shared by all worker processes through RATE_LIMIT_DB
+    GEMINI_RPM: int = int(os.getenv("GEMINI_RPM", "15"))  # Requests per minute
+    GEMINI_RPD: int = int(os.getenv("GEMINI_RPD", "1500"))  # Requests per 24 hours, 0 = unlimited
+    GEMINI_TPM: int = int(os.getenv("GEMINI_TPM", "1000000"))  # Tokens per minute, 0 = unlimited
+    RATE_LIMIT_DB: str = os.getenv("RATE_LIMIT_DB", "./rate_limit.db")
+    
+    # Fair share of the quota per client (named by its X-API-Key, else its IP)
+    SCHEDULER_CLIENT_KEYS: dict = {
+        client.strip(): key.strip()
+        for client, _, key in (
+            entry.partition("=") for entry in os.getenv("SCHEDULER_CLIENT_KEYS", "").split(",") if "=" in entry
+        )
+    }  # e.g. "web=<key>,batch-export=<key>"
+    SCHEDULER_WEIGHTS: dict = {
+        client.strip(): float(weight)
+        for client, _, weight in (
+            entry.partition("=") for entry in os.getenv("SCHEDULER_WEIGHTS", "").split(",") if "=" in entry
+        )
+    }  # e.g. "web=4,batch-export=1"; unlisted clients weigh 1
+    SCHEDULER_MAX_QUEUE: int = int(os.getenv("SCHEDULER_MAX_QUEUE", "20"))  # Queued requests per client before 429
+    
+    # Background workers for messages sent in job mode
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))  # Per process; 0 = only enqueue here
+    JOB_LEASE_SECONDS: int = int(os.getenv("JOB_LEASE_SECONDS", "60"))  # Stale after this long without a heartbeat
+    JOB_POLL_INTERVAL: float = float(os.getenv("JOB_POLL_INTERVAL", "1"))  # Seconds between checks for new jobs
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # Interrupted runs before a job fails
+    
+    # Batch endpoint for bulk offline prompts
+    BATCH_MAX_PROMPTS: int = int(os.getenv("BATCH_MAX_PROMPTS", "10000"))
+    BATCH_CONCURRENCY: int = int(os.getenv("BATCH_CONCURRENCY", "10"))  # Capped at SCHEDULER_MAX_QUEUE
+    BATCH_FLUSH_SIZE: int = int(os.getenv("BATCH_FLUSH_SIZE", "100"))  # Results saved per bulk insert
+    
+    # WebSocket chat channel
+    WS_MAX_IN_FLIGHT: int = int(os.getenv("WS_MAX_IN_FLIGHT", "4"))  # Messages running at once per connection
+    WS_MAX_WAITING: int = int(os.getenv("WS_MAX_WAITING", "16"))  # Messages queued behind those before errors
+    WS_SEND_QUEUE: int = int(os.getenv("WS_SEND_QUEUE", "64"))  # Outgoing frames buffered before producers wait
+    
     UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "./uploads")
+    
+    # Background cleanup: retention and upload garbage collection
+    CLEANUP_INTERVAL: int = int(os.getenv("CLEANUP_INTERVAL", "3600"))  # Seconds between sweeps; 0 = off
+    RETENTION_DAYS: int = int(os.getenv("RETENTION_DAYS", "0"))  # Prune conversations not updated for this long; 0 = keep all
+    UPLOAD_GC_GRACE_SECONDS: int = int(os.getenv("UPLOAD_GC_GRACE_SECONDS", "3600"))  # Younger files are never collected
+    
     MAX_IMAGE_SIZE: int = int(os.getenv("MAX_IMAGE_SIZE", "10485760"))  # 10MB default
     ALLOWED_IMAGE_TYPES: list = ["image/jpeg", "image/jpg", "image/png", "image/webp", "image/gif"]
-    DATABASE_URL: str = "sqlite:///./chat_history.db"
+    DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./chat_history.db")
     MAX_IMAGE_DIMENSION: int = 2048  # Resize images larger than this
+    THUMBNAIL_SIZES: tuple = tuple(
+        int(size) for size in os.getenv("THUMBNAIL_SIZES", "256").split(",") if size.strip()
+    )  # Bounding boxes of the WebP previews generated at upload time
+    IMAGE_PAYLOAD_CACHE_MB: int = int(os.getenv("IMAGE_PAYLOAD_CACHE_MB", "256"))  # Encoded images kept ready for Gemini
+    IMAGE_WORKERS: int = int(os.getenv("IMAGE_WORKERS", "2"))  # Per server process; 0 = process in a thread
+    
+    # Conversation context sent with each message
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000"))  # Verbatim history + summary
+    CONTEXT_MAX_MESSAGES: int = int(os.getenv("CONTEXT_MAX_MESSAGES", "100"))  # Cap on recent turns considered
+    CONTEXT_SUMMARY_TRIGGER_TOKENS: int = int(os.getenv("CONTEXT_SUMMARY_TRIGGER_TOKENS", "2000"))  # Backlog before re-summarizing
+    CONTEXT_SUMMARY_MAX_WORDS: int = int(os.getenv("CONTEXT_SUMMARY_MAX_WORDS", "300"))
+    
+    # Response cache for identical prompt + image inputs (opt-in)
+    RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+    RESPONSE_CACHE_TTL: int = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # seconds
+    RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    
+    # SQLite performance profile (applied on every connection)
+    SQLITE_BUSY_TIMEOUT: int = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # milliseconds
+    SQLITE_CACHE_SIZE_KB: int = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))  # 64MB page cache
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", "268435456"))  # 256MB memory map
     
     def validate(self):
         """Validate required settings"""
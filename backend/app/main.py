@@ -1,13 +1,18 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 import os
 from app.database import init_db
 from app.routes import chat
 from app.config import settings
-
-# Initialize database
-init_db()
+from app.services.cleanup import start_reaper, stop_reaper
+from app.services.jobs import start_job_workers, stop_job_workers
+from app.services.model_router import model_router
+from app.services.response_cache import response_cache
+from app.services.scheduler import scheduler
+from app.utils import metrics
+from app.utils.image_utils import shutdown_image_executor, start_image_executor
+from app.utils.rate_limiter import rate_limiter
+from app.utils.static_files import ImmutableStaticFiles
 
 # Create uploads directory if it doesn't exist
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
@@ -25,10 +30,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Retry-After"],
 )
 
-# Mount uploads directory for serving images
-app.mount("/uploads", StaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
+# Request timing for /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Mount uploads directory for serving images (immutable, cacheable)
+app.mount("/uploads", ImmutableStaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
 
 # Include routers
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
@@ -48,12 +57,31 @@ async def health_check():
         "status": "ok",
         "gemini_api_key": api_key_status,
         "database": "connected",
-        "uploads_dir": os.path.exists(settings.UPLOAD_DIR)
+        "uploads_dir": os.path.exists(settings.UPLOAD_DIR),
+        "response_cache": response_cache.get_stats(),
+        "models": model_router.get_stats(),
+        "quota": await rate_limiter.get_stats(),
+        "scheduler": scheduler.get_stats()
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Prometheus metrics for this worker process"""
+    quota = await rate_limiter.get_stats()
+    for window, key in (("minute", "remaining_minute"), ("day", "remaining_day"),
+                        ("tokens_minute", "remaining_tokens_minute")):
+        if key in quota:
+            metrics.quota_remaining.set(quota[key], window=window)
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.on_event("startup")
 async def startup_event():
-    """Print helpful startup information"""
+    """Initialize the database and print helpful startup information"""
+    await init_db()
+    start_image_executor()
+    start_job_workers()
+    start_reaper()
+    
     print("\n" + "="*60)
     print("🚀 Chimera AI Backend Started Successfully!")
     print("="*60)
@@ -70,3 +98,10 @@ async def startup_event():
         print("   Get your key from: https://makersuite.google.com/app/apikey")
     
     print("="*60 + "\n")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers"""
+    await stop_job_workers()
+    await stop_reaper()
+    shutdown_image_executor()
@@ -0,0 +1,93 @@
+"""
+Lightweight schema migrations for existing SQLite databases
+
+`create_all` only creates missing tables; it never adds columns or indexes
+to tables that already exist. Each migration below upgrades an existing
+database in place and must be safe to run on a freshly created schema.
+The applied version is tracked in SQLite's `PRAGMA user_version`.
+"""
+from sqlalchemy.engine import Connection
+
+def _create_index(connection: Connection, name: str, table: str, columns: str) -> None:
+    """Create an index unless it already exists"""
+    connection.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+def _migration_1_indexes(connection: Connection) -> None:
+    """Index foreign keys and the conversation list ordering"""
+    _create_index(connection, "ix_messages_conversation_id", "messages", "conversation_id")
+    _create_index(connection, "ix_images_message_id", "images", "message_id")
+    _create_index(connection, "ix_conversations_updated_at", "conversations", "updated_at")
+    connection.exec_driver_sql("ANALYZE")
+
+def _add_column(connection: Connection, table: str, column: str, definition: str) -> None:
+    """Add a column unless it already exists"""
+    columns = [row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def _migration_2_blobs(connection: Connection) -> None:
+    """Link images to content-addressed blobs"""
+    _add_column(connection, "images", "blob_id", "INTEGER REFERENCES blobs (id)")
+    _create_index(connection, "ix_images_blob_id", "images", "blob_id")
+
+def _migration_3_thumbnails(connection: Connection) -> None:
+    """Record thumbnail derivatives on images"""
+    _add_column(connection, "images", "thumbnails", "JSON")
+
+def _migration_4_summaries(connection: Connection) -> None:
+    """Store rolling conversation summaries"""
+    _add_column(connection, "conversations", "summary", "TEXT")
+    _add_column(connection, "conversations", "summary_message_id", "INTEGER")
+
+def _migration_5_message_search(connection: Connection) -> None:
+    """
+    Full-text index over message content
+    An external-content FTS5 table kept in sync by triggers, so every
+    writer (ORM, bulk inserts, cascading deletes) updates it alike.
+    """
+    connection.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+        "content, content='messages', content_rowid='id', tokenize='porter unicode61')"
+    )
+    connection.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END"
+    )
+    connection.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END"
+    )
+    connection.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+        "INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+        "INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END"
+    )
+    # Index the messages written before the triggers existed
+    connection.exec_driver_sql("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+def _migration_6_image_paths(connection: Connection) -> None:
+    """Index image paths for upload garbage collection"""
+    _create_index(connection, "ix_images_file_path", "images", "file_path")
+
+# Ordered list of (version, description, migration)
+MIGRATIONS = [
+    (1, "Index foreign keys and conversation ordering", _migration_1_indexes),
+    (2, "Link images to content-addressed blobs", _migration_2_blobs),
+    (3, "Record thumbnail derivatives on images", _migration_3_thumbnails),
+    (4, "Store rolling conversation summaries", _migration_4_summaries),
+    (5, "Full-text index over message content", _migration_5_message_search),
+    (6, "Index image paths for upload garbage collection", _migration_6_image_paths),
+]
+
+def run_migrations(connection: Connection) -> None:
+    """
+    Apply every migration newer than the database's user_version
+    """
+    current_version = connection.exec_driver_sql("PRAGMA user_version").scalar() or 0
+    
+    for version, description, migrate in MIGRATIONS:
+        if version <= current_version:
+            continue
+        print(f"🗄️  Applying migration {version}: {description}")
+        migrate(connection)
+        connection.exec_driver_sql(f"PRAGMA user_version = {version}")
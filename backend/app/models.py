@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Boolean, Column, Integer, String, Text, DateTime, ForeignKey, Index, JSON
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -9,7 +9,9 @@ class Conversation(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    summary = Column(Text, nullable=True)  # Rolling summary of turns older than the context window
+    summary_message_id = Column(Integer, nullable=True)  # Last message folded into the summary
     
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
 
@@ -17,7 +19,7 @@ class Message(Base):
     __tablename__ = "messages"
     
     id = Column(Integer, primary_key=True, index=True)
-    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"))
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), index=True)
     role = Column(String, nullable=False)  # 'user' or 'assistant'
     content = Column(Text, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -29,11 +31,61 @@ class Image(Base):
     __tablename__ = "images"
     
     id = Column(Integer, primary_key=True, index=True)
-    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"))
-    file_path = Column(String, nullable=False)
+    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), index=True)
+    blob_id = Column(Integer, ForeignKey("blobs.id"), index=True, nullable=True)  # None for legacy per-upload files
+    file_path = Column(String, nullable=False, index=True)  # Looked up when reconciling UPLOAD_DIR
     file_name = Column(String, nullable=False)
     mime_type = Column(String, nullable=False)
     file_size = Column(Integer)
+    thumbnails = Column(JSON, nullable=True)  # {"<size>": "<path>"} WebP previews
     created_at = Column(DateTime, default=datetime.utcnow)
     
     message = relationship("Message", back_populates="images")
+    blob = relationship("Blob", back_populates="images")
+
+class Blob(Base):
+    """Content-addressed image file shared by every Image with the same content"""
+    __tablename__ = "blobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    digest = Column(String, unique=True, nullable=False)  # SHA-256 of the normalised image
+    source_digest = Column(String, index=True)  # SHA-256 of the upload it was first created from
+    file_path = Column(String, nullable=False)
+    mime_type = Column(String, nullable=False)
+    file_size = Column(Integer)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    images = relationship("Image", back_populates="blob")
+
+class ResponseCacheEntry(Base):
+    """Cached Gemini response for an exact model + prompt + images combination"""
+    __tablename__ = "response_cache"
+    
+    key = Column(String, primary_key=True)  # SHA-256 of model, text and image digests
+    model = Column(String, nullable=False)
+    response = Column(Text, nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class Job(Base):
+    """Queued Gemini call for a saved user message, run by a background worker"""
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_status_run_after", "status", "run_after"),  # Claiming the next job
+    )
+    
+    id = Column(String, primary_key=True)  # Random hex id handed to the client for polling
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), index=True)
+    user_message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), nullable=False)
+    assistant_message_id = Column(Integer, ForeignKey("messages.id", ondelete="SET NULL"), nullable=True)
+    status = Column(String, nullable=False, default="queued")  # 'queued', 'running', 'done' or 'failed'
+    use_cache = Column(Boolean, nullable=False, default=True)
+    client_id = Column(String, nullable=True)  # Scheduler queue the call is made for
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    run_after = Column(DateTime, default=datetime.utcnow)  # Not claimed before this time
+    locked_until = Column(DateTime, nullable=True)  # Lease of the worker running it
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
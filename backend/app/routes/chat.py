@@ -1,73 +1,237 @@
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi import (
+    APIRouter, Depends, UploadFile, File, Form, HTTPException, Query, Request, Response,
+    WebSocket, WebSocketDisconnect
+)
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import func, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from collections import defaultdict
+from typing import Dict, List, Optional
 from datetime import datetime
-from app.database import get_db
-from app.models import Conversation, Message, Image as ImageModel
+import asyncio
+import base64
+import functools
+import json
+import math
+import uuid
+from app.config import settings
+from app.database import SessionLocal, get_db
+from app.models import Conversation, Job, Message, Image as ImageModel
 from app.schemas import (
     ConversationResponse, 
     MessageResponse, 
     ConversationListItem,
-    ChatResponse
+    BatchPrompt,
+    BatchRequest,
+    ChatResponse,
+    JobResponse,
+    SearchResult
+)
+from app.services.batch import run_batch
+from app.services.cleanup import delete_conversations, remove_files
+from app.services.context import build_history, schedule_summary_refresh
+from app.services.gemini import send_to_gemini, stream_from_gemini
+from app.services.jobs import DONE, FAILED, enqueue_job
+from app.services.scheduler import client_key, scheduler
+from app.services.search import InvalidSearch, search_messages
+from app.services.transfer import InvalidImport, export_ndjson, import_ndjson
+from app.services.storage import (
+    release_files,
+    save_multiple_files
 )
-from app.services.gemini import send_to_gemini
-from app.services.storage import save_multiple_files, delete_file
+from app.utils import metrics
+from app.utils.rate_limiter import QuotaRejected
 
 router = APIRouter()
 
-@router.post("/message", response_model=ChatResponse)
-async def send_message(
-    message: str = Form(...),
-    conversation_id: Optional[int] = Form(None),
-    images: Optional[List[UploadFile]] = File(None),
-    db: Session = Depends(get_db)
+# Seconds between checks while long-polling a job
+JOB_WAIT_INTERVAL = 0.5
+
+# Conversation list page size when no limit is given
+DEFAULT_PAGE_SIZE = 50
+
+async def _get_message(db: AsyncSession, message_id: int) -> Message:
+    """
+    Load a message with its images eagerly (lazy loads are not allowed on
+    an AsyncSession)
+    """
+    result = await db.execute(
+        select(Message).options(selectinload(Message.images)).where(Message.id == message_id)
+    )
+    return result.scalar_one()
+
+async def _save_user_message(
+    db: AsyncSession,
+    message: str,
+    conversation_id: Optional[int],
+    images: Optional[List[UploadFile]]
 ):
     """
-    Send a message to the chatbot with optional images
+    Create or get the conversation, then save the user message and its images
+    Returns (conversation, user_message, image_paths)
     """
+    if conversation_id:
+        conversation = await db.get(Conversation, conversation_id)
+        if not conversation:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+    
+    # Save uploaded images first, each in its own short transaction, so a
+    # rejected upload does not leave an orphaned conversation or message
+    # behind and this session holds no write lock while they are stored
+    with metrics.stage_seconds.time(stage="upload"):
+        saved_files = await save_multiple_files(images, db) if images else []
+    
     try:
-        # Create or get conversation
-        if conversation_id:
-            conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-            if not conversation:
-                raise HTTPException(status_code=404, detail="Conversation not found")
-        else:
+        if not conversation_id:
             # Create new conversation with title from first message
             title = message[:50] + "..." if len(message) > 50 else message
             conversation = Conversation(title=title)
             db.add(conversation)
-            db.commit()
-            db.refresh(conversation)
+            await db.flush()
         
         # Save user message
         user_message = Message(
             conversation_id=conversation.id,
             role="user",
-            content=message
-        )
-        db.add(user_message)
-        db.commit()
-        db.refresh(user_message)
-        
-        # Save uploaded images
-        image_paths = []
-        if images:
-            saved_files = await save_multiple_files(images)
-            for file_info in saved_files:
-                image_record = ImageModel(
-                    message_id=user_message.id,
+            content=message,
+            images=[
+                ImageModel(
+                    blob_id=file_info["blob_id"],
                     file_path=file_info["file_path"],
                     file_name=file_info["file_name"],
                     mime_type=file_info["mime_type"],
-                    file_size=file_info["file_size"]
+                    file_size=file_info["file_size"],
+                    thumbnails=file_info["thumbnails"]
                 )
-                db.add(image_record)
-                image_paths.append(file_info["file_path"])
-            db.commit()
+                for file_info in saved_files
+            ]
+        )
+        db.add(user_message)
+        with metrics.stage_seconds.time(stage="db_commit"):
+            await db.commit()
+    except Exception:
+        await db.rollback()
+        await release_files(saved_files)
+        raise
+    
+    image_paths = [file_info["file_path"] for file_info in saved_files]
+    return conversation, user_message, image_paths
+
+async def _job_response(db: AsyncSession, job: Job) -> JobResponse:
+    """Build a job's status, with the assistant message once it is done"""
+    assistant_message = None
+    if job.assistant_message_id is not None:
+        assistant_message = MessageResponse.from_orm(await _get_message(db, job.assistant_message_id))
+    return JobResponse(
+        id=job.id,
+        status=job.status,
+        conversation_id=job.conversation_id,
+        user_message_id=job.user_message_id,
+        assistant_message=assistant_message,
+        error=job.error,
+        created_at=job.created_at,
+        finished_at=job.finished_at
+    )
+
+async def _save_assistant_message(conversation_id: int, content: str) -> Message:
+    """
+    Save a streamed reply in its own session; the request scoped one may
+    already be closed while the response streams
+    """
+    async with SessionLocal() as db:
+        assistant_message = Message(
+            conversation_id=conversation_id,
+            role="assistant",
+            content=content
+        )
+        db.add(assistant_message)
+        await db.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation_id)
+            .values(updated_at=datetime.utcnow())
+        )
+        with metrics.stage_seconds.time(stage="db_commit"):
+            await db.commit()
+        return await _get_message(db, assistant_message.id)
+
+def _encode_cursor(updated_at: datetime, conversation_id: int) -> str:
+    """
+    Encode an opaque keyset cursor for the conversation list
+    """
+    raw = f"{updated_at.isoformat()}|{conversation_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor: str):
+    """
+    Decode a conversation list cursor into (updated_at, id)
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        updated_at, conversation_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(updated_at), int(conversation_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _sse_event(event: str, data: dict) -> str:
+    """
+    Format a Server-Sent Events frame
+    """
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def _too_many_requests(e: QuotaRejected) -> HTTPException:
+    """429 with Retry-After for a request turned away by the scheduler or limiter"""
+    return HTTPException(
+        status_code=429, detail=str(e),
+        headers={"Retry-After": str(math.ceil(e.retry_after))}
+    )
+
+@router.post("/message", response_model=ChatResponse, responses={202: {"model": JobResponse}})
+async def send_message(
+    request: Request,
+    message: str = Form(...),
+    conversation_id: Optional[int] = Form(None),
+    images: List[UploadFile] = File(default=[]),
+    use_cache: bool = Form(True),
+    job: bool = Form(False),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Send a message to the chatbot with optional images
+    Set use_cache=false to bypass the response cache (e.g. regenerate)
+    Answers 429 with Retry-After when the client has too many requests
+    queued or the daily quota is used up
+
+    With job=true the reply is generated in the background: the response
+    is 202 with a job to poll at GET /jobs/{id} (see the Location header).
+    """
+    metrics.observe_since_request_start(request.scope, "parse")
+    try:
+        conversation, user_message, image_paths = await _save_user_message(
+            db, message, conversation_id, images
+        )
+        
+        if job:
+            queued_job = await enqueue_job(
+                db, conversation.id, user_message.id, use_cache=use_cache, client_id=client_key(request)
+            )
+            return JSONResponse(
+                status_code=202,
+                content=(await _job_response(db, queued_job)).model_dump(mode="json"),
+                headers={"Location": f"/api/chat/jobs/{queued_job.id}"}
+            )
         
         # Get response from Gemini
         try:
-            assistant_response = await send_to_gemini(message, image_paths if image_paths else None)
+            with metrics.stage_seconds.time(stage="history"):
+                history = await build_history(db, conversation, user_message.id)
+            with metrics.stage_seconds.time(stage="gemini"):
+                assistant_response = await send_to_gemini(
+                    message, image_paths if image_paths else None, use_cache=use_cache, history=history,
+                    client_id=client_key(request)
+                )
+        except QuotaRejected as e:
+            raise _too_many_requests(e)
         except Exception as e:
             # If Gemini fails, still save the user message but return error
             raise HTTPException(status_code=500, detail=str(e))
@@ -83,9 +247,11 @@ async def send_message(
         # Update conversation timestamp
         conversation.updated_at = datetime.utcnow()
         
-        db.commit()
-        db.refresh(assistant_message)
-        db.refresh(user_message)
+        with metrics.stage_seconds.time(stage="db_commit"):
+            await db.commit()
+        schedule_summary_refresh(conversation.id)
+        assistant_message = await _get_message(db, assistant_message.id)
+        user_message = await _get_message(db, user_message.id)
         
         return ChatResponse(
             user_message=MessageResponse.from_orm(user_message),
@@ -96,68 +262,498 @@ async def send_message(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
+
+@router.post("/message/stream")
+async def send_message_stream(
+    request: Request,
+    message: str = Form(...),
+    conversation_id: Optional[int] = Form(None),
+    images: List[UploadFile] = File(default=[]),
+    use_cache: bool = Form(True),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Send a message and stream the reply as Server-Sent Events
+
+    Events: `start` (user message), `token` (text chunk), `done` (saved
+    assistant message) or `error`. The assistant message is persisted once
+    the stream completes; a client disconnect cancels the upstream call.
+    Answers 429 with Retry-After, before the stream starts, when the client
+    has too many requests queued or the daily quota is used up.
+    """
+    metrics.observe_since_request_start(request.scope, "parse")
+    try:
+        await scheduler.check_admission(client_key(request))
+    except QuotaRejected as e:
+        raise _too_many_requests(e)
+    try:
+        conversation, user_message, image_paths = await _save_user_message(
+            db, message, conversation_id, images
+        )
+        user_message = await _get_message(db, user_message.id)
+        user_payload = MessageResponse.from_orm(user_message).model_dump(mode="json")
+        with metrics.stage_seconds.time(stage="history"):
+            history = await build_history(db, conversation, user_message.id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
+    
+    conversation_id = conversation.id
+    
+    async def event_stream():
+        yield _sse_event("start", {"conversation_id": conversation_id, "user_message": user_payload})
+        
+        chunks = []
+        stream = stream_from_gemini(
+            message, image_paths if image_paths else None, use_cache=use_cache, history=history,
+            client_id=client_key(request)
+        )
+        try:
+            async for chunk in stream:
+                if await request.is_disconnected():
+                    return
+                chunks.append(chunk)
+                yield _sse_event("token", {"text": chunk})
+        except QuotaRejected as e:
+            yield _sse_event("error", {"detail": str(e), "retry_after": math.ceil(e.retry_after)})
+            return
+        except Exception as e:
+            yield _sse_event("error", {"detail": str(e)})
+            return
+        finally:
+            await stream.aclose()
+        
+        try:
+            assistant_message = await _save_assistant_message(conversation_id, "".join(chunks))
+            payload = MessageResponse.from_orm(assistant_message).model_dump(mode="json")
+        except Exception as e:
+            yield _sse_event("error", {"detail": f"Error saving message: {str(e)}"})
+            return
+        
+        schedule_summary_refresh(conversation_id)
+        yield _sse_event("done", {"conversation_id": conversation_id, "assistant_message": payload})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _parse_ndjson(body: bytes) -> List[BatchPrompt]:
+    """Parse one prompt object per line, skipping blank lines"""
+    prompts = []
+    for line_number, line in enumerate(body.decode("utf-8").splitlines(), start=1):
+        if line.strip():
+            try:
+                prompts.append(BatchPrompt.model_validate_json(line))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid prompt on line {line_number}: {str(e)}")
+    return prompts
+
+@router.websocket("/ws")
+async def chat_socket(websocket: WebSocket):
+    """
+    Persistent chat channel that multiplexes any number of conversations
+
+    Send {"type": "message", "message", "conversation_id", "request_id",
+    "use_cache"} (text only; conversation_id null starts a conversation)
+    or {"type": "cancel", "request_id"}. Every reply frame carries the
+    request_id: `start` (user message saved), `token` (text chunk), `saved`
+    (assistant message saved), `cancelled` or `error`. A message turned
+    away for quota gets an `error` frame with retry_after before anything
+    is saved.
+
+    Backpressure: frames go through a bounded queue to a single writer, so
+    a slow reader pauses token streaming, and at most WS_MAX_IN_FLIGHT
+    messages run at once. Up to WS_MAX_WAITING more wait for a free slot
+    (and can be cancelled meanwhile); beyond that, and for a request_id
+    that is still running, the reply is an error frame. Messages for the
+    same conversation run in the order they were sent.
+    """
+    await websocket.accept()
+    client_id = client_key(websocket)
+    outbox: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE)
+    in_flight = asyncio.Semaphore(settings.WS_MAX_IN_FLIGHT)
+    conversation_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+    turns: Dict[str, asyncio.Task] = {}
+    
+    async def writer():
+        while True:
+            frame = await outbox.get()
+            await websocket.send_text(json.dumps(frame, default=str))
+    
+    async def run_turn(request_id: str, frame: dict):
+        async def send(event: str, **data):
+            await outbox.put({"type": event, "request_id": request_id, **data})
+        
+        conversation_id = frame.get("conversation_id")
+        lock = conversation_locks[conversation_id] if conversation_id else asyncio.Lock()
+        try:
+            async with lock, in_flight:
+                async with SessionLocal() as db:
+                    conversation, user_message, _ = await _save_user_message(
+                        db, frame["message"], conversation_id, None
+                    )
+                    user_message = await _get_message(db, user_message.id)
+                    history = await build_history(db, conversation, user_message.id)
+                conversation_id = conversation.id
+                await send(
+                    "start", conversation_id=conversation_id,
+                    user_message=MessageResponse.from_orm(user_message).model_dump(mode="json")
+                )
+                
+                chunks = []
+                stream = stream_from_gemini(
+                    frame["message"], use_cache=frame.get("use_cache", True) is not False,
+                    history=history, client_id=client_id
+                )
+                try:
+                    async for chunk in stream:
+                        chunks.append(chunk)
+                        await send("token", conversation_id=conversation_id, text=chunk)
+                finally:
+                    await stream.aclose()
+                
+                assistant_message = await _save_assistant_message(conversation_id, "".join(chunks))
+            schedule_summary_refresh(conversation_id)
+            await send(
+                "saved", conversation_id=conversation_id,
+                assistant_message=MessageResponse.from_orm(assistant_message).model_dump(mode="json")
+            )
+        except QuotaRejected as e:
+            await send("error", conversation_id=conversation_id, detail=str(e),
+                       retry_after=math.ceil(e.retry_after))
+        except HTTPException as e:
+            await send("error", conversation_id=conversation_id, detail=e.detail)
+        except Exception as e:
+            await send("error", conversation_id=conversation_id, detail=str(e))
+    
+    def turn_done(request_id: str, turn: asyncio.Task):
+        # Also runs for turns cancelled before they got to start
+        turns.pop(request_id, None)
+        if turn.cancelled() and not outbox.full():
+            outbox.put_nowait({"type": "cancelled", "request_id": request_id})
+    
+    writer_task = asyncio.create_task(writer())
+    try:
+        while True:
+            try:
+                frame = json.loads(await websocket.receive_text())
+            except ValueError:
+                await outbox.put({"type": "error", "request_id": None, "detail": "Frames must be JSON"})
+                continue
+            request_id = str(frame.get("request_id") or uuid.uuid4().hex)
+            
+            if frame.get("type") == "cancel":
+                turn = turns.get(request_id)
+                if turn:
+                    turn.cancel()
+                continue
+            if frame.get("type") != "message" or not isinstance(frame.get("message"), str):
+                await outbox.put({"type": "error", "request_id": request_id,
+                                  "detail": "Expected a message or cancel frame"})
+                continue
+            
+            if request_id in turns:
+                await outbox.put({"type": "error", "request_id": request_id,
+                                  "detail": "A message with this request_id is still running"})
+                continue
+            try:
+                # Turn the message away before it is saved, as /message would
+                await scheduler.check_admission(client_id)
+            except QuotaRejected as e:
+                await outbox.put({"type": "error", "request_id": request_id, "detail": str(e),
+                                  "retry_after": math.ceil(e.retry_after)})
+                continue
+            if len(turns) >= settings.WS_MAX_IN_FLIGHT + settings.WS_MAX_WAITING:
+                await outbox.put({"type": "error", "request_id": request_id,
+                                  "detail": "Too many messages in flight on this connection"})
+                continue
+            
+            turn = asyncio.create_task(run_turn(request_id, frame))
+            turn.add_done_callback(functools.partial(turn_done, request_id))
+            turns[request_id] = turn
+    except WebSocketDisconnect:
+        pass
+    finally:
+        pending = [writer_task, *turns.values()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+@router.post("/batch")
+async def send_batch(request: Request):
+    """
+    Run many prompts in one request and stream results as NDJSON
+
+    Accepts a JSON body ({"prompts": [...], "use_cache": true}), an NDJSON
+    body (application/x-ndjson, one prompt per line) or a multipart upload
+    of an NDJSON file in the `file` field. Each prompt is {"message",
+    "conversation_id", "id"}, where conversation_id and id are optional.
+    Result lines arrive in completion order and carry the prompt's index.
+    """
+    content_type = request.headers.get("content-type", "")
+    use_cache = request.query_params.get("use_cache", "true").lower() not in ("0", "false", "no")
+    try:
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="Upload an NDJSON file in the 'file' field")
+            prompts = _parse_ndjson(await upload.read())
+        elif content_type.startswith(("application/x-ndjson", "application/jsonl")):
+            prompts = _parse_ndjson(await request.body())
+        else:
+            batch = BatchRequest.model_validate_json(await request.body())
+            prompts, use_cache = batch.prompts, batch.use_cache
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch: {str(e)}")
+    
+    if not prompts:
+        raise HTTPException(status_code=400, detail="No prompts given")
+    if len(prompts) > settings.BATCH_MAX_PROMPTS:
+        raise HTTPException(
+            status_code=413, detail=f"At most {settings.BATCH_MAX_PROMPTS} prompts per batch"
+        )
+    
+    return StreamingResponse(
+        run_batch(prompts, use_cache=use_cache, client_id=client_key(request)),
+        media_type="application/x-ndjson"
+    )
+
+async def _request_lines(request: Request):
+    """Yield the lines of a request body as they arrive"""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        if b"\n" not in chunk:
+            continue
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8")
+    if buffer:
+        yield buffer.decode("utf-8")
+
+@router.get("/export")
+async def export_conversations(
+    conversation_id: Optional[List[int]] = Query(None, description="Only these conversations (repeatable)"),
+    include_images: bool = Query(False, description="Embed image content in base64")
+):
+    """
+    Stream conversations, messages and image metadata as NDJSON
+
+    Each conversation line is followed by its messages, each message by
+    its images. The output can be fed back to POST /import.
+    """
+    return StreamingResponse(
+        export_ndjson(conversation_id, include_images=include_images),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="conversations.ndjson"'}
+    )
+
+@router.post("/import")
+async def import_conversations(request: Request):
+    """
+    Import conversations from an NDJSON export (the request body)
+
+    The body is read line by line and saved in chunked transactions, with
+    new ids. Images without embedded content are linked to an identical
+    stored image if there is one, and skipped otherwise. On a bad line the
+    response is 400, on an image that is too large or of an unsupported
+    type 413 or 415 as for uploads; chunks before it stay imported.
+    """
+    try:
+        counts = await import_ndjson(_request_lines(request))
+    except (InvalidImport, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid import: {str(e)}")
+    return {"success": True, "imported": counts}
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=30),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get the status of a message sent in job mode
+
+    Pass wait (seconds) to long-poll: the response is held until the job
+    is done or failed, or the wait runs out.
+    """
+    deadline = asyncio.get_running_loop().time() + wait
+    while True:
+        job = await db.get(Job, job_id, populate_existing=True)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if job.status in (DONE, FAILED) or asyncio.get_running_loop().time() >= deadline:
+            return await _job_response(db, job)
+        # End the read transaction so the next check sees the worker's commit
+        await db.commit()
+        await asyncio.sleep(JOB_WAIT_INTERVAL)
 
 @router.get("/conversations", response_model=List[ConversationListItem])
-async def get_conversations(db: Session = Depends(get_db)):
+async def get_conversations(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=200),
+    cursor: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_db)
+):
     """
-    Get all conversations with basic info
+    Get conversations with basic info, most recently updated first
+
+    Keyset-paginated on (updated_at, id): pass the `X-Next-Cursor`
+    response header back as `cursor` for the next page.
     """
-    conversations = db.query(Conversation).order_by(Conversation.updated_at.desc()).all()
+    message_count = (
+        select(func.count(Message.id))
+        .where(Message.conversation_id == Conversation.id)
+        .correlate(Conversation)
+        .scalar_subquery()
+    )
+    query = (
+        select(Conversation, message_count)
+        .order_by(Conversation.updated_at.desc(), Conversation.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        updated_at, last_id = _decode_cursor(cursor)
+        query = query.where(tuple_(Conversation.updated_at, Conversation.id) < tuple_(updated_at, last_id))
+    
+    rows = (await db.execute(query)).all()
+    
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1][0]
+        response.headers["X-Next-Cursor"] = _encode_cursor(last.updated_at, last.id)
     
-    result = []
-    for conv in conversations:
-        result.append(ConversationListItem(
+    return [
+        ConversationListItem(
             id=conv.id,
             title=conv.title,
             created_at=conv.created_at,
             updated_at=conv.updated_at,
-            message_count=len(conv.messages)
-        ))
-    
-    return result
+            message_count=count
+        )
+        for conv, count in rows
+    ]
 
 @router.get("/conversations/{conversation_id}", response_model=ConversationResponse)
-async def get_conversation(conversation_id: int, db: Session = Depends(get_db)):
+async def get_conversation(conversation_id: int, db: AsyncSession = Depends(get_db)):
     """
     Get a specific conversation with all messages
     """
-    conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+    result = await db.execute(
+        select(Conversation)
+        .options(selectinload(Conversation.messages).selectinload(Message.images))
+        .where(Conversation.id == conversation_id)
+    )
+    conversation = result.scalar_one_or_none()
     
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
     return ConversationResponse.from_orm(conversation)
 
+@router.get("/conversations/{conversation_id}/messages", response_model=List[MessageResponse])
+async def get_conversation_messages(
+    conversation_id: int,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[int] = Query(None, description="Only messages older than this message id"),
+    since: Optional[int] = Query(None, description="Only messages newer than this message id"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get a page of messages from a conversation, newest first
+
+    Pass the `X-Next-Cursor` response header back as `before` to fetch the
+    next (older) page. Use `since` with the newest id already seen to fetch
+    only new messages.
+    """
+    if not await db.get(Conversation, conversation_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    
+    query = (
+        select(Message)
+        .options(selectinload(Message.images))
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.id.desc())
+        .limit(limit + 1)
+    )
+    if before is not None:
+        query = query.where(Message.id < before)
+    if since is not None:
+        query = query.where(Message.id > since)
+    
+    messages = (await db.execute(query)).scalars().all()
+    
+    if len(messages) > limit:
+        messages = messages[:limit]
+        response.headers["X-Next-Cursor"] = str(messages[-1].id)
+    
+    return [MessageResponse.from_orm(message) for message in messages]
+
+@router.get("/search", response_model=List[SearchResult])
+async def search(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=500, description="Words to find; end a word with * to match prefixes"),
+    conversation_id: Optional[int] = Query(None, description="Only search this conversation"),
+    since: Optional[datetime] = Query(None, description="Only messages created at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only messages created before this time"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Full-text search over all messages, best match first
+
+    Every word must match (stemmed, case-insensitive). Pass the
+    `X-Next-Cursor` response header back as `cursor` for the next page.
+    Pages are cut by relevance score, which shifts as messages are added
+    or deleted: a later page may then skip or repeat results. Each page
+    re-scores every match, so prefer narrow queries over deep paging.
+    """
+    try:
+        results, next_cursor = await search_messages(
+            db, q, limit=limit, cursor=cursor, conversation_id=conversation_id,
+            since=since, until=until
+        )
+    except InvalidSearch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [SearchResult(**result) for result in results]
+
 @router.delete("/conversations/{conversation_id}")
-async def delete_conversation(conversation_id: int, db: Session = Depends(get_db)):
+async def delete_conversation(conversation_id: int, db: AsyncSession = Depends(get_db)):
     """
     Delete a conversation and all its messages
+    Rows are deleted in SQL; files are unlinked in the background.
     """
-    conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-    
-    if not conversation:
+    exists = await db.scalar(select(Conversation.id).where(Conversation.id == conversation_id))
+    if exists is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    # Delete associated image files
-    for message in conversation.messages:
-        for image in message.images:
-            delete_file(image.file_path)
+    unlink_paths = await delete_conversations(db, [conversation_id])
+    await db.commit()
     
-    db.delete(conversation)
-    db.commit()
+    # Only unlink files once nothing references them any more
+    await remove_files(unlink_paths)
     
     return {"success": True, "message": "Conversation deleted"}
 
 @router.post("/conversations")
-async def create_conversation(db: Session = Depends(get_db)):
+async def create_conversation(db: AsyncSession = Depends(get_db)):
     """
     Create a new empty conversation
     """
-    conversation = Conversation(title="New Conversation")
+    conversation = Conversation(title="New Conversation", messages=[])
     db.add(conversation)
-    db.commit()
-    db.refresh(conversation)
+    await db.commit()
     
     return ConversationResponse.from_orm(conversation)
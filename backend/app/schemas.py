@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
 from datetime import datetime
 
 class ImageInfo(BaseModel):
@@ -8,6 +8,7 @@ class ImageInfo(BaseModel):
     file_name: str
     mime_type: str
     file_size: Optional[int] = None
+    thumbnails: Optional[Dict[str, str]] = None  # Preview paths keyed by bounding box size
     created_at: datetime
     
     class Config:
@@ -44,6 +45,15 @@ class ConversationListItem(BaseModel):
     class Config:
         from_attributes = True
 
+class SearchResult(BaseModel):
+    message_id: int
+    conversation_id: int
+    conversation_title: Optional[str] = None
+    role: str
+    snippet: str  # HTML-escaped excerpt with matches wrapped in <mark>
+    rank: float  # BM25 score, lower is a better match
+    created_at: datetime
+
 class ChatRequest(BaseModel):
     message: str
     conversation_id: Optional[int] = None
@@ -52,3 +62,49 @@ class ChatResponse(BaseModel):
     user_message: MessageResponse
     assistant_message: MessageResponse
     conversation_id: int
+
+class JobResponse(BaseModel):
+    id: str
+    status: str  # 'queued', 'running', 'done' or 'failed'
+    conversation_id: int
+    user_message_id: int
+    assistant_message: Optional[MessageResponse] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+class BatchPrompt(BaseModel):
+    message: str
+    conversation_id: Optional[int] = None  # None starts a new conversation
+    id: Optional[str] = None  # Caller's reference, echoed in the result
+
+class BatchRequest(BaseModel):
+    prompts: List[BatchPrompt]
+    use_cache: bool = True
+
+# NDJSON export/import records (see app.services.transfer); ids are the
+# exporting database's and are remapped on import
+class ExportConversation(BaseModel):
+    type: Literal["conversation"] = "conversation"
+    id: int
+    title: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+class ExportMessage(BaseModel):
+    type: Literal["message"] = "message"
+    id: int
+    conversation_id: int
+    role: str
+    content: str
+    created_at: datetime
+
+class ExportImage(BaseModel):
+    type: Literal["image"] = "image"
+    message_id: int
+    file_name: str
+    mime_type: str
+    file_size: Optional[int] = None
+    digest: Optional[str] = None  # Content hash of the stored image
+    data: Optional[str] = None  # Base64 image content, if exported with images
+    created_at: datetime
@@ -0,0 +1,164 @@
+"""
+Bulk prompt runs for offline workloads
+
+A batch saves every prompt's conversation and user message up front in
+two bulk inserts. It then runs the Gemini calls concurrently, bounded so
+they never overflow the client's scheduler queue. Results are saved in
+bulk as they complete and streamed back in completion order.
+"""
+import asyncio
+import json
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
+from sqlalchemy import insert, select, update
+from app.config import settings
+from app.database import SessionLocal
+from app.models import Conversation, Message
+from app.schemas import BatchPrompt
+from app.services.context import build_history, schedule_summary_refresh
+from app.services.gemini import send_to_gemini
+from app.utils.rate_limiter import QuotaRejected
+
+async def _save_prompts(prompts: List[BatchPrompt]) -> List[dict]:
+    """
+    Create conversations and user messages for every prompt in one transaction
+    Returns one item per prompt with its conversation and user message ids;
+    prompts naming a missing conversation get an error instead.
+    """
+    items = [{"index": index, "id": prompt.id} for index, prompt in enumerate(prompts)]
+
+    async with SessionLocal() as db:
+        requested = {prompt.conversation_id for prompt in prompts if prompt.conversation_id}
+        existing = set()
+        if requested:
+            existing = set((await db.execute(
+                select(Conversation.id).where(Conversation.id.in_(requested))
+            )).scalars())
+
+        new_conversations = [index for index, prompt in enumerate(prompts) if not prompt.conversation_id]
+        if new_conversations:
+            conversation_ids = (await db.execute(
+                insert(Conversation).returning(Conversation.id, sort_by_parameter_order=True),
+                [
+                    {"title": prompts[index].message[:50] + "..." if len(prompts[index].message) > 50
+                     else prompts[index].message}
+                    for index in new_conversations
+                ]
+            )).scalars().all()
+            for index, conversation_id in zip(new_conversations, conversation_ids):
+                items[index]["conversation_id"] = conversation_id
+                items[index]["new"] = True
+
+        for index, prompt in enumerate(prompts):
+            if prompt.conversation_id:
+                items[index]["conversation_id"] = prompt.conversation_id
+                items[index]["new"] = False
+                if prompt.conversation_id not in existing:
+                    items[index]["error"] = "Conversation not found"
+
+        runnable = [item for item in items if "error" not in item]
+        if runnable:
+            message_ids = (await db.execute(
+                insert(Message).returning(Message.id, sort_by_parameter_order=True),
+                [
+                    {"conversation_id": item["conversation_id"], "role": "user",
+                     "content": prompts[item["index"]].message}
+                    for item in runnable
+                ]
+            )).scalars().all()
+            for item, message_id in zip(runnable, message_ids):
+                item["user_message_id"] = message_id
+
+        await db.commit()
+    return items
+
+async def _run_prompt(item: dict, prompt: BatchPrompt, use_cache: bool, client_id: Optional[str]) -> dict:
+    """Get the reply for one saved prompt; errors are reported in the item"""
+    try:
+        history = None
+        if not item["new"]:
+            async with SessionLocal() as db:
+                conversation = await db.get(Conversation, item["conversation_id"])
+                history = await build_history(db, conversation, item["user_message_id"])
+        item["response"] = await send_to_gemini(
+            prompt.message, use_cache=use_cache, history=history, client_id=client_id
+        )
+    except QuotaRejected as e:
+        item["error"] = str(e)
+        item["retry_after"] = round(e.retry_after)
+    except Exception as e:
+        item["error"] = str(e)
+    return item
+
+async def _save_results(items: List[dict]) -> None:
+    """Save the replies of finished items with one bulk insert"""
+    answered = [item for item in items if "response" in item]
+    if not answered:
+        return
+
+    now = datetime.utcnow()
+    async with SessionLocal() as db:
+        message_ids = (await db.execute(
+            insert(Message).returning(Message.id, sort_by_parameter_order=True),
+            [
+                {"conversation_id": item["conversation_id"], "role": "assistant",
+                 "content": item["response"], "created_at": now}
+                for item in answered
+            ]
+        )).scalars().all()
+        await db.execute(
+            update(Conversation),
+            [{"id": conversation_id, "updated_at": now}
+             for conversation_id in {item["conversation_id"] for item in answered}]
+        )
+        await db.commit()
+
+    for item, message_id in zip(answered, message_ids):
+        item["assistant_message_id"] = message_id
+        if not item["new"]:
+            schedule_summary_refresh(item["conversation_id"])
+
+def _result_line(item: dict) -> str:
+    item.pop("new", None)
+    return json.dumps(item) + "\n"
+
+async def run_batch(prompts: List[BatchPrompt], use_cache: bool = True,
+                    client_id: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Run a batch of prompts, yielding one NDJSON result line per prompt as
+    it completes. Closing the generator cancels the prompts still running.
+    """
+    items = await _save_prompts(prompts)
+    for item in items:
+        if "error" in item:
+            yield _result_line(item)
+
+    # More concurrent calls than the scheduler queues for one client
+    # would only be turned away with 429s
+    limit = asyncio.Semaphore(max(1, min(settings.BATCH_CONCURRENCY, settings.SCHEDULER_MAX_QUEUE)))
+
+    async def run(item: dict) -> dict:
+        async with limit:
+            return await _run_prompt(item, prompts[item["index"]], use_cache, client_id)
+
+    tasks = [asyncio.create_task(run(item)) for item in items if "error" not in item]
+    finished: asyncio.Queue = asyncio.Queue()
+    for task in tasks:
+        task.add_done_callback(finished.put_nowait)
+
+    try:
+        remaining = len(tasks)
+        while remaining:
+            # Wait for one result, then take whatever else is ready, so fast
+            # results are saved in bulk and slow ones without delay
+            done = [(await finished.get()).result()]
+            while not finished.empty() and len(done) < settings.BATCH_FLUSH_SIZE:
+                done.append(finished.get_nowait().result())
+            remaining -= len(done)
+
+            await _save_results(done)
+            for item in done:
+                yield _result_line(item)
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,262 @@
+"""
+Conversation deletion, retention and upload garbage collection
+
+Conversations are deleted with a handful of set-based statements, however
+many messages and images they hold. Their files are unlinked afterwards
+by a background reaper, off the request path. Every CLEANUP_INTERVAL the
+reaper also prunes conversations older than RETENTION_DAYS and reconciles
+UPLOAD_DIR against the database in batches, removing files nothing
+references any more (e.g. left behind by a crash).
+"""
+import asyncio
+import itertools
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Optional, Set
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.database import SessionLocal
+from app.models import Blob, Conversation, Image as ImageModel, Job, Message
+from app.services.storage import release_conversation_blobs, remove_unreferenced_files
+from app.utils.image_utils import IMAGE_EXTENSIONS
+
+# Files checked against the database per query while reconciling
+RECONCILE_BATCH_SIZE = 500
+
+# Conversations deleted per transaction when pruning
+PRUNE_BATCH_SIZE = 200
+
+# Leftovers of uploads that were being received or processed
+_TEMP_SUFFIXES = (".part", ".out")
+
+_DIGEST = re.compile(r"[0-9a-f]{64}")
+
+# Unreferenced files waiting to be unlinked by the reaper
+_pending_files: List[str] = []
+
+_reaper: Optional[asyncio.Task] = None
+
+# Set when files are queued, so the reaper does not wait for its next sweep
+_wakeup: Optional[asyncio.Event] = None
+
+async def delete_conversations(db: AsyncSession, conversation_ids: List[int]) -> List[str]:
+    """
+    Delete conversations with their messages, images and jobs in SQL
+    Returns the file paths to pass to remove_files() once the caller has
+    committed
+    """
+    paths = await release_conversation_blobs(db, conversation_ids)
+
+    # Nothing is loaded into the session, so there is nothing to synchronize
+    options = {"synchronize_session": False}
+    messages = select(Message.id).where(Message.conversation_id.in_(conversation_ids))
+    for statement in (
+        delete(ImageModel).where(ImageModel.message_id.in_(messages)),
+        delete(Job).where(Job.conversation_id.in_(conversation_ids)),
+        delete(Message).where(Message.conversation_id.in_(conversation_ids)),
+        delete(Conversation).where(Conversation.id.in_(conversation_ids)),
+    ):
+        await db.execute(statement, execution_options=options)
+    return paths
+
+async def remove_files(paths: Iterable[str]) -> None:
+    """
+    Hand files that nothing references any more to the reaper
+    Without a running reaper they are unlinked right away.
+    """
+    paths = list(paths)
+    if not paths:
+        return
+
+    if _reaper is None:
+        await remove_unreferenced_files(paths)
+        return
+    _pending_files.extend(paths)
+    _wakeup.set()
+
+async def prune_conversations() -> int:
+    """
+    Delete conversations not updated for RETENTION_DAYS, a batch per transaction
+    Returns the number of conversations deleted
+    """
+    if settings.RETENTION_DAYS <= 0:
+        return 0
+
+    cutoff = datetime.utcnow() - timedelta(days=settings.RETENTION_DAYS)
+    pruned = 0
+    while True:
+        async with SessionLocal() as db:
+            conversation_ids = list(await db.scalars(
+                select(Conversation.id).where(Conversation.updated_at < cutoff).limit(PRUNE_BATCH_SIZE)
+            ))
+            if not conversation_ids:
+                break
+            paths = await delete_conversations(db, conversation_ids)
+            await db.commit()
+        await remove_files(paths)
+        pruned += len(conversation_ids)
+
+    if pruned:
+        print(f"🧹 Pruned {pruned} conversations not updated in {settings.RETENTION_DAYS} days")
+    return pruned
+
+def _walk_uploads() -> Iterator[str]:
+    for directory, _, file_names in os.walk(settings.UPLOAD_DIR):
+        for file_name in file_names:
+            yield os.path.join(directory, file_name)
+
+def _next_batch(files: Iterator[str], cutoff: float) -> Optional[List[str]]:
+    """
+    Next batch of files last modified before cutoff; younger files may
+    belong to an upload still in progress. None once the walk is done.
+    """
+    batch = list(itertools.islice(files, RECONCILE_BATCH_SIZE))
+    if not batch:
+        return None
+    old = []
+    for path in batch:
+        try:
+            if os.path.getmtime(path) < cutoff:
+                old.append(path)
+        except OSError:
+            pass
+    return old
+
+def _classify(path: str):
+    """
+    What a file in UPLOAD_DIR is: ("blob", digest) for a content-addressed
+    image or thumbnail, ("legacy", path) for a per-upload file, ("temp",
+    path) for an upload leftover, or None for anything else (left alone)
+    """
+    parts = os.path.relpath(path, settings.UPLOAD_DIR).split(os.sep)
+    stem, extension = os.path.splitext(parts[-1])
+    if len(parts) == 1:
+        if parts[0].startswith(".") and parts[0].endswith(_TEMP_SUFFIXES):
+            return "temp", path
+        if extension.lower() in (*IMAGE_EXTENSIONS.values(), ".jpeg"):
+            return "legacy", path
+        return None
+    if (len(parts) == 2 or (len(parts) == 4 and parts[0] == "thumbs")) and _DIGEST.fullmatch(stem):
+        return "blob", stem
+    return None
+
+async def _legacy_references() -> Optional[Set[str]]:
+    """
+    Real paths of the files that legacy image rows point at, or None if
+    any of them does not resolve to a file directly in UPLOAD_DIR (e.g. it
+    was stored relative to another working directory); legacy files are
+    then left alone, as they cannot be matched safely
+    """
+    root = os.path.realpath(settings.UPLOAD_DIR)
+    async with SessionLocal() as db:
+        stored = await db.scalars(select(ImageModel.file_path).where(ImageModel.blob_id.is_(None)))
+    referenced = set()
+    for file_path in stored:
+        path = os.path.realpath(file_path)
+        if os.path.dirname(path) != root:
+            return None
+        referenced.add(path)
+    return referenced
+
+async def _unreferenced(paths: List[str], legacy_references: Optional[Set[str]]) -> List[str]:
+    """The files among paths that no blob or image row references"""
+    kinds = {path: _classify(path) for path in paths}
+    digests = {kind[1] for kind in kinds.values() if kind and kind[0] == "blob"}
+
+    stored_digests = set()
+    if digests:
+        async with SessionLocal() as db:
+            stored_digests = set(await db.scalars(select(Blob.digest).where(Blob.digest.in_(digests))))
+
+    orphans = []
+    for path, kind in kinds.items():
+        if kind is None:
+            continue
+        if kind[0] == "blob":
+            unreferenced = kind[1] not in stored_digests
+        elif kind[0] == "legacy":
+            unreferenced = (legacy_references is not None
+                            and os.path.realpath(path) not in legacy_references)
+        else:
+            unreferenced = True
+        if unreferenced:
+            orphans.append(path)
+    return orphans
+
+async def reconcile_uploads() -> int:
+    """
+    Remove files in UPLOAD_DIR that nothing references, a batch at a time
+    Files younger than UPLOAD_GC_GRACE_SECONDS are never touched.
+    Returns the number of files removed
+    """
+    cutoff = time.time() - settings.UPLOAD_GC_GRACE_SECONDS
+    legacy_references = await _legacy_references()
+    if legacy_references is None:
+        print("⚠️  Some image paths do not resolve into UPLOAD_DIR; keeping all legacy upload files")
+    files = _walk_uploads()
+    removed = 0
+    while True:
+        batch = await asyncio.to_thread(_next_batch, files, cutoff)
+        if batch is None:
+            break
+        orphans = await _unreferenced(batch, legacy_references) if batch else []
+        # Blobs referenced again since are kept
+        removed += await remove_unreferenced_files(orphans)
+
+    if removed:
+        print(f"🧹 Removed {removed} unreferenced files from {settings.UPLOAD_DIR}")
+    return removed
+
+async def _reap() -> None:
+    """Unlink queued files as they come in, and sweep every CLEANUP_INTERVAL"""
+    loop = asyncio.get_running_loop()
+    last_sweep = 0.0
+    while True:
+        try:
+            if _pending_files:
+                paths = _pending_files[:]
+                _pending_files.clear()
+                await remove_unreferenced_files(paths)
+
+            if settings.CLEANUP_INTERVAL > 0 and loop.time() - last_sweep >= settings.CLEANUP_INTERVAL:
+                last_sweep = loop.time()
+                await prune_conversations()
+                await reconcile_uploads()
+
+            _wakeup.clear()
+            if _pending_files:
+                continue
+            timeout = None
+            if settings.CLEANUP_INTERVAL > 0:
+                timeout = max(1.0, settings.CLEANUP_INTERVAL - (loop.time() - last_sweep))
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Warning: Upload reaper error: {str(e)}")
+            await asyncio.sleep(60)
+
+def start_reaper() -> None:
+    """Start the background reaper in this process"""
+    global _reaper, _wakeup
+    _wakeup = asyncio.Event()
+    _reaper = asyncio.create_task(_reap())
+
+async def stop_reaper() -> None:
+    """Stop the reaper, unlinking whatever it still had queued"""
+    global _reaper
+    if _reaper is None:
+        return
+    _reaper.cancel()
+    await asyncio.gather(_reaper, return_exceptions=True)
+    _reaper = None
+    if _pending_files:
+        paths = _pending_files[:]
+        _pending_files.clear()
+        await remove_unreferenced_files(paths)
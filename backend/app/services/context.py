@@ -0,0 +1,156 @@
+"""
+Conversation context for Gemini requests
+
+Recent turns are sent verbatim within CONTEXT_TOKEN_BUDGET; older turns are
+folded into a rolling summary stored on the conversation, so the cost of a
+request stays flat however long the conversation gets.
+"""
+import asyncio
+from typing import List, Optional, Set
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import settings
+from app.database import SessionLocal
+from app.models import Conversation, Message
+
+# Conversations whose summary is being refreshed right now
+_summarizing: Set[int] = set()
+
+# Running summary tasks; the event loop only keeps weak references to them
+_tasks: Set[asyncio.Task] = set()
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+def _gemini_role(role: str) -> str:
+    return "model" if role == "assistant" else "user"
+
+async def _recent_window(db: AsyncSession, conversation: Conversation, before_message_id: Optional[int]):
+    """
+    Newest unsummarized messages that fit in the token budget, oldest first
+    Returns (rows, tokens_left)
+    """
+    budget = settings.CONTEXT_TOKEN_BUDGET
+    if conversation.summary:
+        budget -= estimate_tokens(conversation.summary)
+    
+    query = (
+        select(Message.id, Message.role, Message.content)
+        .where(Message.conversation_id == conversation.id, Message.id > (conversation.summary_message_id or 0))
+        .order_by(Message.id.desc())
+        .limit(settings.CONTEXT_MAX_MESSAGES)
+    )
+    if before_message_id is not None:
+        query = query.where(Message.id < before_message_id)
+    
+    window = []
+    for row in (await db.execute(query)).all():
+        cost = estimate_tokens(row.content)
+        if cost > budget:
+            break
+        budget -= cost
+        window.append(row)
+    window.reverse()
+    return window, budget
+
+async def build_history(db: AsyncSession, conversation: Conversation,
+                        before_message_id: Optional[int] = None) -> List[dict]:
+    """
+    Earlier turns of a conversation as Gemini contents, for send_to_gemini()
+    """
+    window, _ = await _recent_window(db, conversation, before_message_id)
+    
+    history = []
+    if conversation.summary:
+        history.append({"role": "user", "parts": [f"Summary of our conversation so far:\n{conversation.summary}"]})
+        history.append({"role": "model", "parts": ["Understood, I'll keep that context in mind."]})
+    
+    for row in window:
+        role = _gemini_role(row.role)
+        if history and history[-1]["role"] == role:
+            # Keep turns alternating, e.g. after a failed reply
+            history[-1]["parts"].append(row.content)
+        else:
+            history.append({"role": role, "parts": [row.content]})
+    return history
+
+async def refresh_summary(conversation_id: int) -> None:
+    """
+    Fold turns that no longer fit in the verbatim window into the summary
+    Runs after a reply is saved; only calls Gemini once the unsummarized
+    backlog reaches CONTEXT_SUMMARY_TRIGGER_TOKENS
+    """
+    from app.services.gemini import send_to_gemini
+    
+    async with SessionLocal() as db:
+        conversation = await db.get(Conversation, conversation_id)
+        if conversation is None:
+            return
+        
+        window, _ = await _recent_window(db, conversation, None)
+        if not window:
+            return
+        
+        # Oldest first: everything between the summary and the verbatim window
+        backlog_rows = (await db.execute(
+            select(Message.id, Message.role, Message.content)
+            .where(
+                Message.conversation_id == conversation_id,
+                Message.id > (conversation.summary_message_id or 0),
+                Message.id < window[0].id
+            )
+            .order_by(Message.id)
+        )).all()
+        
+        backlog = []
+        tokens = 0
+        for row in backlog_rows:
+            tokens += estimate_tokens(row.content)
+            backlog.append(row)
+            if tokens >= settings.CONTEXT_TOKEN_BUDGET:
+                break
+        if tokens < settings.CONTEXT_SUMMARY_TRIGGER_TOKENS:
+            return
+        
+        transcript = "\n\n".join(f"{row.role.upper()}: {row.content}" for row in backlog)
+        prompt = (
+            "Update the running summary of a chat between a user and an assistant. "
+            "Keep facts, decisions, names and open questions; drop pleasantries. "
+            f"Stay under {settings.CONTEXT_SUMMARY_MAX_WORDS} words and reply with the summary only.\n\n"
+            f"Current summary:\n{conversation.summary or '(none)'}\n\n"
+            f"New turns:\n{transcript}"
+        )
+        summary = await send_to_gemini(prompt, use_cache=False)
+        
+        # Only advance if nobody else moved the summary meanwhile
+        await db.execute(
+            update(Conversation)
+            .where(
+                Conversation.id == conversation_id,
+                Conversation.summary_message_id.is_not_distinct_from(conversation.summary_message_id)
+            )
+            # Keep updated_at as is; summarizing must not reorder the conversation list
+            .values(summary=summary, summary_message_id=backlog[-1].id, updated_at=Conversation.updated_at)
+        )
+        await db.commit()
+        print(f"📝 Summarized {len(backlog)} messages of conversation {conversation_id}")
+
+async def _refresh_summary_task(conversation_id: int) -> None:
+    try:
+        await refresh_summary(conversation_id)
+    except Exception as e:
+        print(f"Warning: Could not summarize conversation {conversation_id}: {str(e)}")
+    finally:
+        _summarizing.discard(conversation_id)
+
+def schedule_summary_refresh(conversation_id: int) -> None:
+    """
+    Refresh a conversation's summary in the background, off the reply path
+    """
+    if conversation_id in _summarizing:
+        return
+    _summarizing.add(conversation_id)
+    task = asyncio.get_running_loop().create_task(_refresh_summary_task(conversation_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
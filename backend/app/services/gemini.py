@@ -1,63 +1,418 @@
+import asyncio
+import hashlib
+import json
+import time
 import google.generativeai as genai
-from PIL import Image as PILImage
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from app.config import settings
-from app.utils.rate_limiter import rate_limiter
+from app.services.model_router import NOT_RETRYABLE, classify_error, model_router
+from app.services.response_cache import response_cache
+from app.services.scheduler import QueueFull, scheduler
+from app.utils import metrics
+from app.utils.payload_cache import image_payload_cache
+from app.utils.rate_limiter import QuotaRejected, rate_limiter
 
 # Configure Gemini API
 genai.configure(api_key=settings.GEMINI_API_KEY)
 
-async def send_to_gemini(text: str, image_paths: Optional[List[str]] = None) -> str:
+# Gemini bills an image as a fixed number of tokens regardless of its size
+IMAGE_TOKENS = 258
+
+# Requests are identified by the primary model; the router may answer
+# them on a fallback
+MODEL_NAME = model_router.primary
+
+async def _build_contents(text: str, image_paths: Optional[List[str]] = None,
+                          history: Optional[List[dict]] = None):
     """
-    Send a message with optional images to Gemini 2.5 Flash
-    Returns the response text
+    Build the request contents - text first, then images for better results
+    Earlier turns from history (see app.services.context) go before the
+    new message
+    """
+    if image_paths and len(image_paths) > 0:
+        parts = [text]
+        
+        # Add images as pre-encoded parts; nothing is decoded here
+        parts.extend(await image_payload_cache.load_many(image_paths))
+    elif not history:
+        # Text only
+        return text
+    else:
+        parts = [text]
+    
+    contents = [{"role": turn["role"], "parts": list(turn["parts"])} for turn in history or []]
+    if contents and contents[-1]["role"] == "user":
+        # Gemini expects turns to alternate; merge with an unanswered user turn
+        contents[-1]["parts"].extend(parts)
+    else:
+        contents.append({"role": "user", "parts": parts})
+    return contents
+
+def _gemini_error(e: Exception) -> Exception:
+    """
+    Translate a Gemini client error into a user-friendly exception
+    """
+    import traceback
+    if isinstance(e, QuotaRejected):
+        # Already user-friendly, and callers need retry_after
+        return e
+    
+    error_message = str(e)
+    print(f"Gemini API Error: {error_message}")
+    print(traceback.format_exc())
+    
+    # Handle common errors with helpful messages
+    if "API key" in error_message or "api_key" in error_message.lower():
+        return Exception("Invalid or missing Gemini API key. Please check your configuration in backend/.env file.")
+    elif "quota" in error_message.lower() or "resource" in error_message.lower():
+        return Exception("API quota exceeded. Please try again later or upgrade your plan.")
+    elif "safety" in error_message.lower() or "block" in error_message.lower():
+        return Exception("Content was blocked by safety filters. Try rephrasing your message.")
+    elif "not found" in error_message.lower() or "models/" in error_message.lower():
+        return Exception("Gemini model not found. Please check your API key has access to the models in GEMINI_MODELS at https://aistudio.google.com/")
+    else:
+        return Exception(f"Failed to get response from Gemini: {error_message}")
+
+async def _request_key(text: str, image_paths: Optional[List[str]],
+                       history: Optional[List[dict]] = None) -> str:
+    """
+    Identity of a request: model, prompt text, image content hashes and
+    conversation context
+    """
+    image_digests = [await image_payload_cache.digest(path) for path in image_paths or []]
+    payload = json.dumps([MODEL_NAME, text, image_digests, history or []])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+async def _cache_key(text: str, image_paths: Optional[List[str]], use_cache: bool,
+                     history: Optional[List[dict]] = None) -> Optional[str]:
+    """
+    Response cache key for a request, or None if caching does not apply
+    """
+    if not (use_cache and response_cache.enabled):
+        return None
+    return await _request_key(text, image_paths, history)
+
+# Upstream calls currently running, by request key (single-flight), with
+# the client whose scheduler queue each one waits in
+_in_flight: Dict[str, Tuple[asyncio.Task, Optional[str]]] = {}
+
+def _response_text(response) -> str:
+    """
+    Text of a response, or an error if it was blocked or empty
+    """
+    try:
+        text = response.text if response else None
+    except (AttributeError, ValueError):
+        # Handle cases where response.text is not available
+        raise Exception("Response was blocked by safety filters or content policy.")
+    if not text:
+        raise Exception("Response was blocked or empty. Try rephrasing your message.")
+    return text
+
+def _estimate_tokens(contents) -> int:
+    """
+    Rough prompt size for the rate limiter, about 4 characters per token
+    """
+    if isinstance(contents, str):
+        return len(contents) // 4 + 1
+    tokens = 0
+    for content in contents:
+        for part in content["parts"]:
+            tokens += len(part) // 4 + 1 if isinstance(part, str) else IMAGE_TOKENS
+    return tokens
+
+async def _record_usage(response, estimated_tokens: int, response_text: str) -> None:
+    """
+    Tell the rate limiter how many tokens a request really used
+    SDK versions that report usage_metadata give the exact count; older
+    ones (like the pinned 0.4.0) do not, so the reply is counted instead
+    and added to the prompt estimate.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    total_tokens = getattr(usage, "total_token_count", None)
+    if total_tokens:
+        await rate_limiter.record_tokens(total_tokens - estimated_tokens)
+    else:
+        await rate_limiter.record_tokens(_estimate_tokens(response_text))
+
+def _attempt_started(model_name: str) -> float:
+    """Report an upstream call to the router and metrics; returns its start time"""
+    model_router.record_attempt(model_name)
+    metrics.gemini_requests_in_flight.inc(model=model_name)
+    return time.monotonic()
+
+def _attempt_finished(model_name: str, started: float, error: Optional[Exception] = None,
+                      cancelled: bool = False) -> None:
+    """Report how an upstream call ended to the router and metrics"""
+    latency = time.monotonic() - started
+    metrics.gemini_requests_in_flight.dec(model=model_name)
+    if cancelled:
+        model_router.release(model_name)
+        outcome = "cancelled"
+    elif error is not None:
+        outcome = classify_error(error)
+        model_router.record_failure(model_name, outcome)
+    else:
+        model_router.record_success(model_name, latency)
+        outcome = "success"
+    metrics.gemini_request_seconds.observe(latency, model=model_name, outcome=outcome)
+
+async def _call_model(model_name: str, contents, reserved: bool = False) -> str:
+    """
+    Make one upstream generate_content call and report it to the router
+    reserved means the scheduler already took a rate limiter slot for it
+    """
+    # Apply rate limiting before API call
+    estimated_tokens = _estimate_tokens(contents)
+    if not reserved:
+        await rate_limiter.wait_if_needed(estimated_tokens)
+    
+    model = genai.GenerativeModel(model_name)
+    started = _attempt_started(model_name)
+    try:
+        response = await model.generate_content_async(contents)
+        text = _response_text(response)
+    except asyncio.CancelledError:
+        _attempt_finished(model_name, started, cancelled=True)
+        raise
+    except Exception as e:
+        _attempt_finished(model_name, started, error=e)
+        raise
+    
+    _attempt_finished(model_name, started)
+    print(f"✅ Successfully used model: {model_name}")
+    await _record_usage(response, estimated_tokens, text)
+    return text
+
+def _no_models_error() -> Exception:
+    return Exception("All Gemini models are temporarily unavailable. Please try again shortly.")
+
+async def _generate_with_fallback(candidates: List[str], contents):
+    """
+    Try each candidate model in turn until one answers; the first attempt
+    uses the slot the scheduler reserved, fallbacks take their own
+    Returns (text, model_name)
+    """
+    last_error = _no_models_error()
+    for attempt, model_name in enumerate(candidates):
+        try:
+            return await _call_model(model_name, contents, reserved=attempt == 0), model_name
+        except Exception as e:
+            last_error = e
+            if classify_error(e) == NOT_RETRYABLE:
+                raise
+            print(f"↪️  {model_name} failed, trying the next model: {str(e)[:100]}")
+    raise last_error
+
+async def _generate_hedged(candidates: List[str], contents):
+    """
+    Like _generate_with_fallback, but if a model has not answered within
+    GEMINI_HEDGE_DELAY the next one is started too; the first answer wins
+    Returns (text, model_name)
+    """
+    remaining = list(candidates)
+    running: Dict[asyncio.Task, str] = {}
+    last_error = _no_models_error()
+    
+    def launch():
+        reserved = len(remaining) == len(candidates)
+        model_name = remaining.pop(0)
+        running[asyncio.create_task(_call_model(model_name, contents, reserved))] = model_name
+    
+    launch()
+    try:
+        while running:
+            done, _ = await asyncio.wait(
+                running,
+                timeout=settings.GEMINI_HEDGE_DELAY if remaining else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                print(f"🏁 No answer after {settings.GEMINI_HEDGE_DELAY}s, hedging with {remaining[0]}")
+                launch()
+                continue
+            
+            for task in done:
+                model_name = running.pop(task)
+                try:
+                    return task.result(), model_name
+                except Exception as e:
+                    last_error = e
+                    if classify_error(e) == NOT_RETRYABLE:
+                        raise
+            if remaining:
+                launch()
+        raise last_error
+    finally:
+        for task in running:
+            task.cancel()
+
+async def _generate(text: str, image_paths: Optional[List[str]], history: Optional[List[dict]],
+                    cache_key: Optional[str], client_id: Optional[str]) -> str:
+    """
+    Generate a reply on the best available model
     """
     try:
-        # Apply rate limiting before API call
-        rate_limiter.wait_if_needed()
+        contents = await _build_contents(text, image_paths, history)
         
-        # Use Gemini 2.5 Flash as primary model
-        model = genai.GenerativeModel('gemini-2.5-flash')
+        candidates = model_router.candidates()
+        if not candidates:
+            raise _no_models_error()
         
-        if image_paths and len(image_paths) > 0:
-            # Prepare content parts - text first, then images for better results
-            parts = [text]
-            
-            # Add images
-            for img_path in image_paths:
-                img = PILImage.open(img_path)
-                parts.append(img)
-            
-            response = model.generate_content(parts)
-        else:
-            # Text only
-            response = model.generate_content(text)
+        # Wait for this client's fair share of the quota
+        await scheduler.acquire(client_id, _estimate_tokens(contents))
         
-        # Handle response
-        if response and hasattr(response, 'text'):
-            print(f"✅ Successfully used model: gemini-2.5-flash")
-            return response.text
+        if settings.GEMINI_HEDGE_DELAY > 0 and len(candidates) > 1:
+            response_text, model_name = await _generate_hedged(candidates, contents)
         else:
-            raise Exception("Response was blocked or empty. Try rephrasing your message.")
+            response_text, model_name = await _generate_with_fallback(candidates, contents)
+        
+        if cache_key:
+            await response_cache.put(cache_key, model_name, response_text)
+        return response_text
     
-    except AttributeError as e:
-        # Handle cases where response.text is not available
-        raise Exception("Response was blocked by safety filters or content policy.")
+    except Exception as e:
+        raise _gemini_error(e)
+
+def _finish_flight(key: str, task: asyncio.Task) -> None:
+    """Forget a finished upstream call and mark its outcome as retrieved"""
+    if _in_flight.get(key, (None, None))[0] is task:
+        del _in_flight[key]
+    if not task.cancelled():
+        task.exception()
+
+async def send_to_gemini(text: str, image_paths: Optional[List[str]] = None, use_cache: bool = True,
+                         history: Optional[List[dict]] = None, client_id: Optional[str] = None) -> str:
+    """
+    Send a message with optional images to the best available Gemini model
+    history holds earlier conversation turns (see app.services.context)
+    client_id picks the scheduler queue (see app.services.scheduler)
+    Returns the response text
+
+    With use_cache (the default), identical requests may be answered from
+    the response cache, and concurrent identical requests share a single
+    upstream call and rate limiter slot. A caller that goes away does not
+    cancel the shared call for the others. A caller that joined another
+    client's call is not turned away by that client's full queue; it is
+    queued under its own client_id instead.
+    """
+    if not use_cache:
+        return await _generate(text, image_paths, history, None, client_id)
     
+    try:
+        key = await _request_key(text, image_paths, history)
     except Exception as e:
-        import traceback
-        error_message = str(e)
-        print(f"Gemini API Error: {error_message}")
-        print(traceback.format_exc())
-        
-        # Handle common errors with helpful messages
-        if "API key" in error_message or "api_key" in error_message.lower():
-            raise Exception("Invalid or missing Gemini API key. Please check your configuration in backend/.env file.")
-        elif "quota" in error_message.lower() or "resource" in error_message.lower():
-            raise Exception("API quota exceeded. Please try again later or upgrade your plan.")
-        elif "safety" in error_message.lower() or "block" in error_message.lower():
-            raise Exception("Content was blocked by safety filters. Try rephrasing your message.")
-        elif "not found" in error_message.lower() or "models/" in error_message.lower():
-            raise Exception("Model 'gemini-2.5-flash' not found. Please check your API key has access to Gemini 2.5 Flash at https://aistudio.google.com/")
-        else:
-            raise Exception(f"Failed to get response from Gemini: {error_message}")
+        raise _gemini_error(e)
+    cache_key = key if response_cache.enabled else None
+    
+    if cache_key:
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    
+    task, owner = _in_flight.get(key, (None, None))
+    if task is None:
+        task = asyncio.create_task(_generate(text, image_paths, history, cache_key, client_id))
+        _in_flight[key] = (task, client_id)
+        task.add_done_callback(lambda finished: _finish_flight(key, finished))
+        return await asyncio.shield(task)
+    
+    print(f"🔗 Joining in-flight request {key[:12]}")
+    try:
+        return await asyncio.shield(task)
+    except QueueFull:
+        if owner == client_id:
+            raise
+    # The call was turned away for the client that started it, so go
+    # through the scheduler as this client instead
+    return await _generate(text, image_paths, history, cache_key, client_id)
+
+async def _stream_model(model_name: str, contents, reserved: bool = False) -> AsyncIterator[str]:
+    """
+    Stream from one model and report the outcome to the router
+    reserved means the scheduler already took a rate limiter slot for it
+    """
+    # Apply rate limiting before API call
+    estimated_tokens = _estimate_tokens(contents)
+    if not reserved:
+        await rate_limiter.wait_if_needed(estimated_tokens)
+    
+    model = genai.GenerativeModel(model_name)
+    started = _attempt_started(model_name)
+    finished = False
+    try:
+        response = await model.generate_content_async(contents, stream=True)
+        
+        received = []
+        async for chunk in response:
+            try:
+                chunk_text = chunk.text
+            except (AttributeError, ValueError):
+                # Chunks without text (e.g. safety metadata only)
+                continue
+            if chunk_text:
+                received.append(chunk_text)
+                yield chunk_text
+        
+        if not received:
+            raise Exception("Response was blocked or empty. Try rephrasing your message.")
+        
+        finished = True
+        _attempt_finished(model_name, started)
+        print(f"✅ Successfully streamed from model: {model_name}")
+        await _record_usage(response, estimated_tokens, "".join(received))
+    except Exception as e:
+        finished = True
+        _attempt_finished(model_name, started, error=e)
+        raise
+    finally:
+        if not finished:
+            # Closed early by the caller
+            _attempt_finished(model_name, started, cancelled=True)
+
+async def stream_from_gemini(text: str, image_paths: Optional[List[str]] = None,
+                             use_cache: bool = True,
+                             history: Optional[List[dict]] = None,
+                             client_id: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Stream a response from the best available Gemini model
+    Yields text chunks as they arrive; closing the generator abandons the
+    upstream call. A cached response is yielded as a single chunk. Falls
+    back to the next model only if nothing has been streamed yet.
+    """
+    try:
+        cache_key = await _cache_key(text, image_paths, use_cache, history)
+        if cache_key:
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        
+        contents = await _build_contents(text, image_paths, history)
+        
+        last_error = _no_models_error()
+        candidates = model_router.candidates()
+        if candidates:
+            # Wait for this client's fair share of the quota
+            await scheduler.acquire(client_id, _estimate_tokens(contents))
+        
+        for attempt, model_name in enumerate(candidates):
+            chunks = []
+            try:
+                async for chunk_text in _stream_model(model_name, contents, reserved=attempt == 0):
+                    chunks.append(chunk_text)
+                    yield chunk_text
+            except Exception as e:
+                last_error = e
+                if chunks or classify_error(e) == NOT_RETRYABLE:
+                    raise
+                print(f"↪️  {model_name} failed, trying the next model: {str(e)[:100]}")
+                continue
+            
+            if cache_key:
+                await response_cache.put(cache_key, model_name, "".join(chunks))
+            return
+        raise last_error
+    
+    except Exception as e:
+        raise _gemini_error(e)
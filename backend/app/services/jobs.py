@@ -0,0 +1,248 @@
+"""
+Durable queue of Gemini calls for messages sent in job mode
+
+Jobs are rows in the main SQLite database, so they survive restarts and
+are shared by every worker process. A worker claims a job with a single
+UPDATE ... RETURNING, which SQLite serializes, and holds a lease on it
+that it keeps extending while the call runs. A job whose lease ran out
+(its worker died) goes back to the queue.
+"""
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from app.config import settings
+from app.database import SessionLocal
+from app.models import Conversation, Job, Message
+from app.services.context import build_history, schedule_summary_refresh
+from app.services.gemini import send_to_gemini
+from app.utils.rate_limiter import QuotaRejected
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_workers: List[asyncio.Task] = []
+
+# Set when a job is enqueued in this process, so idle workers skip the poll
+_wakeup: Optional[asyncio.Event] = None
+
+def _lease() -> timedelta:
+    return timedelta(seconds=settings.JOB_LEASE_SECONDS)
+
+async def enqueue_job(db: AsyncSession, conversation_id: int, user_message_id: int,
+                      use_cache: bool = True, client_id: Optional[str] = None) -> Job:
+    """
+    Queue a Gemini call for a saved user message
+    """
+    job = Job(
+        id=uuid.uuid4().hex,
+        conversation_id=conversation_id,
+        user_message_id=user_message_id,
+        status=QUEUED,
+        use_cache=use_cache,
+        client_id=client_id
+    )
+    db.add(job)
+    await db.commit()
+
+    if _wakeup is not None:
+        _wakeup.set()
+    return job
+
+async def _claim_job() -> Optional[str]:
+    """Take the oldest runnable job, if any; returns its id"""
+    now = datetime.utcnow()
+    async with SessionLocal() as db:
+        next_job = (
+            select(Job.id)
+            .where(Job.status == QUEUED, Job.run_after <= now)
+            .order_by(Job.run_after, Job.created_at)
+            .limit(1)
+            .scalar_subquery()
+        )
+        result = await db.execute(
+            update(Job)
+            .where(Job.id == next_job, Job.status == QUEUED)
+            .values(status=RUNNING, attempts=Job.attempts + 1, locked_until=now + _lease())
+            .returning(Job.id)
+            .execution_options(synchronize_session=False)
+        )
+        job_id = result.scalar_one_or_none()
+        await db.commit()
+        return job_id
+
+async def requeue_stale_jobs() -> None:
+    """
+    Put jobs whose worker stopped renewing its lease back in the queue,
+    or fail them once they have used up their attempts
+    """
+    now = datetime.utcnow()
+    async with SessionLocal() as db:
+        stale = (Job.status == RUNNING, Job.locked_until < now)
+        requeued = await db.execute(
+            update(Job)
+            .where(*stale, Job.attempts < settings.JOB_MAX_ATTEMPTS)
+            .values(status=QUEUED, locked_until=None, run_after=now)
+            .returning(Job.id)
+            .execution_options(synchronize_session=False)
+        )
+        failed = await db.execute(
+            update(Job)
+            .where(*stale)
+            .values(status=FAILED, locked_until=None, finished_at=now,
+                    error="The job was interrupted too many times")
+            .returning(Job.id)
+            .execution_options(synchronize_session=False)
+        )
+        requeued_ids, failed_ids = requeued.scalars().all(), failed.scalars().all()
+        await db.commit()
+
+    if requeued_ids or failed_ids:
+        print(f"♻️  Requeued {len(requeued_ids)} and failed {len(failed_ids)} stale jobs")
+
+async def _finish_job(db: AsyncSession, job_id: str, **values) -> bool:
+    """
+    Update a job this worker still holds; False if it was requeued or
+    deleted meanwhile, in which case the caller must roll back
+    """
+    result = await db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == RUNNING)
+        .values(locked_until=None, **values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+async def _keep_lease(job_id: str) -> None:
+    """Extend a running job's lease until cancelled"""
+    while True:
+        await asyncio.sleep(settings.JOB_LEASE_SECONDS / 3)
+        async with SessionLocal() as db:
+            await db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == RUNNING)
+                .values(locked_until=datetime.utcnow() + _lease())
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+async def _run_job(job_id: str) -> None:
+    """Call Gemini for a claimed job and save the assistant message"""
+    async with SessionLocal() as db:
+        job = await db.get(Job, job_id)
+        conversation = await db.get(Conversation, job.conversation_id)
+        user_message = (await db.execute(
+            select(Message).options(selectinload(Message.images)).where(Message.id == job.user_message_id)
+        )).scalar_one_or_none()
+
+        if conversation is None or user_message is None:
+            await _finish_job(db, job_id, status=FAILED, finished_at=datetime.utcnow(),
+                              error="Conversation not found")
+            await db.commit()
+            return
+
+        try:
+            history = await build_history(db, conversation, user_message.id)
+            # Don't keep a transaction open for the whole Gemini call
+            await db.commit()
+
+            image_paths = [image.file_path for image in user_message.images]
+            assistant_response = await send_to_gemini(
+                user_message.content, image_paths if image_paths else None,
+                use_cache=job.use_cache, history=history, client_id=job.client_id
+            )
+        except QuotaRejected as e:
+            # Turned away for now; wait in the queue instead of failing
+            await _finish_job(db, job_id, status=QUEUED, attempts=Job.attempts - 1,
+                              run_after=datetime.utcnow() + timedelta(seconds=e.retry_after))
+            await db.commit()
+            print(f"⏳ Job {job_id[:8]} deferred for {e.retry_after:.0f}s: {str(e)}")
+            return
+        except Exception as e:
+            await _finish_job(db, job_id, status=FAILED, finished_at=datetime.utcnow(), error=str(e))
+            await db.commit()
+            return
+
+        assistant_message = Message(
+            conversation_id=conversation.id,
+            role="assistant",
+            content=assistant_response
+        )
+        db.add(assistant_message)
+        await db.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation.id)
+            .values(updated_at=datetime.utcnow())
+        )
+        await db.flush()
+
+        if not await _finish_job(db, job_id, status=DONE, finished_at=datetime.utcnow(),
+                                 assistant_message_id=assistant_message.id):
+            await db.rollback()
+            print(f"Warning: Job {job_id[:8]} was taken over or deleted; dropping its result")
+            return
+        await db.commit()
+
+    schedule_summary_refresh(conversation.id)
+
+async def _release_job(job_id: str) -> None:
+    """Hand an interrupted job straight back to the queue"""
+    async with SessionLocal() as db:
+        await _finish_job(db, job_id, status=QUEUED, attempts=Job.attempts - 1,
+                          run_after=datetime.utcnow())
+        await db.commit()
+
+async def _worker(number: int) -> None:
+    """Claim and run jobs until cancelled"""
+    last_sweep = 0.0
+    loop = asyncio.get_running_loop()
+    while True:
+        job_id = None
+        try:
+            if loop.time() - last_sweep >= settings.JOB_LEASE_SECONDS:
+                last_sweep = loop.time()
+                await requeue_stale_jobs()
+
+            _wakeup.clear()
+            job_id = await _claim_job()
+            if job_id is None:
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), timeout=settings.JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            lease = asyncio.create_task(_keep_lease(job_id))
+            try:
+                await _run_job(job_id)
+            finally:
+                lease.cancel()
+        except asyncio.CancelledError:
+            if job_id is not None:
+                await _release_job(job_id)
+            raise
+        except Exception as e:
+            print(f"Warning: Job worker {number} error: {str(e)}")
+            await asyncio.sleep(settings.JOB_POLL_INTERVAL)
+
+def start_job_workers() -> None:
+    """Start JOB_WORKERS background workers in this process"""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    for number in range(settings.JOB_WORKERS):
+        _workers.append(asyncio.create_task(_worker(number)))
+    if _workers:
+        print(f"👷 Started {len(_workers)} job workers")
+
+async def stop_job_workers() -> None:
+    """Stop the workers, returning any job they were running to the queue"""
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
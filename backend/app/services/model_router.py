@@ -0,0 +1,191 @@
+"""
+Latency-aware routing across Gemini models with circuit breaking
+"""
+import time
+from typing import Dict, List
+from app.config import settings
+from app.utils import metrics
+from app.utils.rate_limiter import QuotaRejected
+
+# Circuit breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Failure kinds, see classify_error()
+QUOTA = "quota"
+UNAVAILABLE = "unavailable"
+FAILURE = "failure"
+NOT_RETRYABLE = "not_retryable"
+
+def classify_error(error: Exception) -> str:
+    """
+    Decide whether an error is the model's fault and worth a fallback
+    Bad API keys and safety blocks would fail on every model alike.
+    """
+    if isinstance(error, QuotaRejected):
+        # Turned away by our own limits, which every model shares
+        return NOT_RETRYABLE
+    message = str(error).lower()
+    if "api key" in message or "api_key" in message:
+        return NOT_RETRYABLE
+    if "safety" in message or "block" in message:
+        return NOT_RETRYABLE
+    if "quota" in message or "resource" in message or "429" in message:
+        return QUOTA
+    if "not found" in message or "models/" in message:
+        return UNAVAILABLE
+    return FAILURE
+
+class ModelHealth:
+    """Rolling latency and error statistics for one model"""
+
+    def __init__(self, name: str, preference: int):
+        self.name = name
+        self.preference = preference  # Position in the configured model list
+        self.latency = None  # Exponentially weighted moving average, seconds
+        self.error_rate = 0.0  # Exponentially weighted moving average, 0..1
+        self.successes = 0
+        self.failures = 0
+        self.quota_errors = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.trial_in_progress = False
+
+class ModelRouter:
+    """Route each request to the fastest healthy model"""
+
+    def __init__(self, models: List[str], failure_threshold: int = 3, open_seconds: float = 30,
+                 quota_open_seconds: float = 60, unavailable_open_seconds: float = 3600,
+                 ewma_alpha: float = 0.2):
+        """
+        Initialize model router
+
+        Args:
+            models: Models allowed by policy, in order of preference
+            failure_threshold: Consecutive failures that open a model's circuit
+            open_seconds: How long a circuit stays open after failures
+            quota_open_seconds: How long a circuit stays open after a quota error
+            unavailable_open_seconds: How long a circuit stays open for a missing model
+            ewma_alpha: Weight of the newest sample in the moving averages
+        """
+        self.models: Dict[str, ModelHealth] = {
+            name: ModelHealth(name, index) for index, name in enumerate(models)
+        }
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.quota_open_seconds = quota_open_seconds
+        self.unavailable_open_seconds = unavailable_open_seconds
+        self.ewma_alpha = ewma_alpha
+
+    @property
+    def primary(self) -> str:
+        """The most preferred model"""
+        return next(iter(self.models))
+
+    def _available(self, health: ModelHealth, now: float) -> bool:
+        if health.state == OPEN and now >= health.open_until:
+            health.state = HALF_OPEN
+        if health.state == HALF_OPEN:
+            # One trial request at a time decides whether the circuit closes
+            return not health.trial_in_progress
+        return health.state == CLOSED
+
+    def candidates(self) -> List[str]:
+        """
+        Healthy models to try, best first
+
+        Models with latency samples are ordered fastest first; models not
+        measured yet follow in configured order.
+        """
+        now = time.monotonic()
+        available = [health for health in self.models.values() if self._available(health, now)]
+        available.sort(key=lambda health: (
+            health.latency is None,
+            health.latency if health.latency is not None else 0,
+            health.preference
+        ))
+        return [health.name for health in available]
+
+    def record_attempt(self, model: str) -> None:
+        """Mark a request as started; a half-open model allows one at a time"""
+        health = self.models[model]
+        if health.state == HALF_OPEN:
+            health.trial_in_progress = True
+
+    def release(self, model: str) -> None:
+        """Forget an attempt that was cancelled before it finished"""
+        self.models[model].trial_in_progress = False
+
+    def record_success(self, model: str, latency: float) -> None:
+        """Record a successful call and its latency"""
+        health = self.models[model]
+        health.successes += 1
+        health.consecutive_failures = 0
+        health.latency = latency if health.latency is None else (
+            self.ewma_alpha * latency + (1 - self.ewma_alpha) * health.latency
+        )
+        health.error_rate *= 1 - self.ewma_alpha
+        health.state = CLOSED
+        health.trial_in_progress = False
+
+    def record_failure(self, model: str, kind: str) -> None:
+        """Record a failed call, opening the circuit when needed"""
+        health = self.models[model]
+        health.trial_in_progress = False
+        if kind == NOT_RETRYABLE:
+            # Not the model's fault; it is not a health signal either way
+            if health.state == HALF_OPEN:
+                health.state = OPEN
+            return
+
+        health.failures += 1
+        health.consecutive_failures += 1
+        health.error_rate = self.ewma_alpha + (1 - self.ewma_alpha) * health.error_rate
+
+        open_for = None
+        if kind == QUOTA:
+            health.quota_errors += 1
+            open_for = self.quota_open_seconds
+        elif kind == UNAVAILABLE:
+            open_for = self.unavailable_open_seconds
+        elif health.state == HALF_OPEN or health.consecutive_failures >= self.failure_threshold:
+            open_for = self.open_seconds
+
+        if open_for is not None:
+            health.state = OPEN
+            health.open_until = time.monotonic() + open_for
+            print(f"🔌 Circuit opened for {model} ({kind}) for {open_for:.0f}s")
+
+    def get_stats(self) -> List[dict]:
+        """Per-model health for /api/health"""
+        now = time.monotonic()
+        stats = []
+        for health in self.models.values():
+            self._available(health, now)
+            stats.append({
+                "model": health.name,
+                "state": health.state,
+                "latency_ms": round(health.latency * 1000) if health.latency is not None else None,
+                "error_rate": round(health.error_rate, 3),
+                "successes": health.successes,
+                "failures": health.failures,
+                "quota_errors": health.quota_errors,
+            })
+        return stats
+
+# Global model router instance
+model_router = ModelRouter(
+    settings.GEMINI_MODELS,
+    failure_threshold=settings.GEMINI_CIRCUIT_FAILURES,
+    open_seconds=settings.GEMINI_CIRCUIT_OPEN_SECONDS
+)
+
+metrics.Gauge(
+    "chimera_gemini_circuit_open", "1 while a model is out of rotation", ("model",),
+    function=lambda: {
+        (health.name,): int(health.state == OPEN and time.monotonic() < health.open_until)
+        for health in model_router.models.values()
+    }
+)
@@ -0,0 +1,96 @@
+"""
+Persistent cache of Gemini responses for identical prompt + image inputs
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import delete, func, select, update
+from app.config import settings
+from app.database import SessionLocal
+from app.models import ResponseCacheEntry
+from app.utils import metrics
+
+class ResponseCache:
+    """Opt-in response cache stored in SQLite, with TTL and LRU eviction"""
+    
+    def __init__(self, enabled: bool, ttl_seconds: int, max_entries: int):
+        """
+        Initialize response cache
+        
+        Args:
+            enabled: Whether responses are cached at all
+            ttl_seconds: How long a cached response stays valid
+            max_entries: Entries kept before the least recently used are evicted
+        """
+        self.enabled = enabled
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+    
+    async def get(self, key: str) -> Optional[str]:
+        """Get a fresh cached response, marking it as recently used"""
+        try:
+            async with SessionLocal() as db:
+                entry = await db.get(ResponseCacheEntry, key)
+                now = datetime.utcnow()
+                if entry is None or entry.created_at < now - self.ttl:
+                    self.misses += 1
+                    return None
+                
+                await db.execute(
+                    update(ResponseCacheEntry)
+                    .where(ResponseCacheEntry.key == key)
+                    .values(last_used_at=now, hits=ResponseCacheEntry.hits + 1)
+                )
+                await db.commit()
+                self.hits += 1
+                return entry.response
+        except Exception as e:
+            print(f"Warning: Response cache lookup failed: {str(e)}")
+            return None
+    
+    async def put(self, key: str, model: str, response: str) -> None:
+        """Store a response, then drop expired and least recently used entries"""
+        try:
+            async with SessionLocal() as db:
+                now = datetime.utcnow()
+                await db.merge(ResponseCacheEntry(
+                    key=key,
+                    model=model,
+                    response=response,
+                    hits=0,
+                    created_at=now,
+                    last_used_at=now
+                ))
+                await db.flush()
+                await db.execute(
+                    delete(ResponseCacheEntry).where(ResponseCacheEntry.created_at < now - self.ttl)
+                )
+                
+                count = (await db.execute(select(func.count()).select_from(ResponseCacheEntry))).scalar_one()
+                if count > self.max_entries:
+                    oldest = (
+                        select(ResponseCacheEntry.key)
+                        .order_by(ResponseCacheEntry.last_used_at)
+                        .limit(count - self.max_entries)
+                    )
+                    await db.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.key.in_(oldest)))
+                await db.commit()
+        except Exception as e:
+            print(f"Warning: Could not cache response: {str(e)}")
+    
+    def get_stats(self) -> dict:
+        """Hit/miss counters for this process"""
+        return {"enabled": self.enabled, "hits": self.hits, "misses": self.misses}
+
+# Global response cache instance
+response_cache = ResponseCache(
+    enabled=settings.RESPONSE_CACHE_ENABLED,
+    ttl_seconds=settings.RESPONSE_CACHE_TTL,
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES
+)
+
+metrics.Counter(
+    "chimera_response_cache_requests_total", "Response cache lookups", ("result",),
+    function=lambda: {("hit",): response_cache.hits, ("miss",): response_cache.misses}
+)
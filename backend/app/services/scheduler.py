@@ -0,0 +1,189 @@
+"""
+Weighted fair scheduling of the Gemini quota across clients
+"""
+import asyncio
+import heapq
+import hmac
+import itertools
+import math
+import time
+from collections import Counter
+from typing import Dict, Optional
+from fastapi.requests import HTTPConnection
+from app.config import settings
+from app.utils import metrics
+from app.utils.rate_limiter import QuotaRejected, rate_limiter
+
+# Requests made by the server itself (e.g. conversation summaries)
+INTERNAL_CLIENT = "internal"
+
+class QueueFull(QuotaRejected):
+    """A client already has as many requests queued as it may"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(
+            f"Too many requests queued. Try again in {math.ceil(retry_after)} seconds.",
+            retry_after
+        )
+
+def client_key(request: HTTPConnection) -> str:
+    """
+    Identify the client a request (or WebSocket) is scheduled for
+    An X-API-Key header listed in SCHEDULER_CLIENT_KEYS names its client;
+    anything else is scheduled by peer IP, so only configured clients can
+    claim their weight or a queue of their own.
+    """
+    api_key = request.headers.get("x-api-key")
+    if api_key:
+        for client, key in settings.SCHEDULER_CLIENT_KEYS.items():
+            if hmac.compare_digest(key.encode(), api_key.encode()):
+                return client
+    return request.client.host if request.client else "unknown"
+
+class _Ticket:
+    """One request waiting for a rate limiter slot"""
+
+    __slots__ = ("client", "tokens", "future", "dequeued")
+
+    def __init__(self, client: str, tokens: int, future: asyncio.Future):
+        self.client = client
+        self.tokens = tokens
+        self.future = future
+        self.dequeued = False
+
+class FairScheduler:
+    """
+    Hand out rate limiter slots by weighted fair queueing
+
+    Every request gets a virtual finish tag of max(virtual time, client's
+    last tag) + 1 / weight, and slots go to the smallest tag first. A client
+    sending a burst pushes only its own tags into the future, so a client
+    with a single request is served next, without waiting for the burst.
+    Slots are reserved one at a time, so the queue lives here instead of in
+    the rate limiter, where its order could no longer change.
+    """
+
+    def __init__(self, weights: Dict[str, float], max_queue: int, requests_per_minute: int):
+        """
+        Initialize scheduler
+
+        Args:
+            weights: Share of the quota per client, relative to the default of 1
+            max_queue: Requests a client may have waiting before it gets a 429
+            requests_per_minute: Quota rate, used to estimate Retry-After
+        """
+        self.weights = weights
+        self.max_queue = max_queue
+        self.requests_per_minute = requests_per_minute
+        self._heap = []
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._last_tag: Dict[str, float] = {}
+        self._queued: Counter = Counter()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.granted = 0
+        self.rejected = 0
+
+    def _retry_after(self) -> float:
+        """Seconds until everything queued now has had its slot"""
+        queued = sum(self._queued.values())
+        return max(1.0, queued * 60 / self.requests_per_minute)
+
+    def _check_queue(self, client: str) -> None:
+        if self._queued[client] >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull(self._retry_after())
+
+    async def check_admission(self, client: Optional[str]) -> None:
+        """
+        Raise QueueFull or QuotaExhausted now if acquire() would turn the
+        client away, so streaming routes can answer 429 before they start
+        """
+        self._check_queue(client or INTERNAL_CLIENT)
+        await rate_limiter.check_daily_quota()
+
+    async def acquire(self, client: Optional[str], tokens: int = 0) -> None:
+        """
+        Wait for this client's turn and a rate limiter slot
+        Raises QueueFull at once if the client's queue is full.
+        """
+        client = client or INTERNAL_CLIENT
+        self._check_queue(client)
+
+        weight = self.weights.get(client, 1.0)
+        tag = max(self._virtual_time, self._last_tag.get(client, 0.0)) + 1 / weight
+        self._last_tag[client] = tag
+
+        ticket = _Ticket(client, tokens, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._heap, (tag, next(self._sequence), ticket))
+        self._queued[client] += 1
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        started = time.perf_counter()
+        try:
+            await ticket.future
+            metrics.scheduler_wait_seconds.observe(time.perf_counter() - started)
+        except asyncio.CancelledError:
+            # The caller went away; the dispatcher skips the ticket
+            self._dequeue(ticket)
+            raise
+
+    def _dequeue(self, ticket: _Ticket) -> None:
+        if not ticket.dequeued:
+            ticket.dequeued = True
+            self._queued[ticket.client] -= 1
+            if not self._queued[ticket.client]:
+                del self._queued[ticket.client]
+
+    async def _dispatch(self) -> None:
+        """Reserve slots for queued requests, smallest tag first"""
+        try:
+            while self._heap:
+                tag, _, ticket = heapq.heappop(self._heap)
+                if ticket.dequeued:
+                    continue
+                self._dequeue(ticket)
+                self._virtual_time = tag
+
+                try:
+                    await rate_limiter.wait_if_needed(ticket.tokens)
+                except Exception as e:
+                    if not ticket.future.done():
+                        ticket.future.set_exception(e)
+                    continue
+
+                if not ticket.future.done():
+                    ticket.future.set_result(None)
+                    self.granted += 1
+
+            # Tags only matter relative to each other; start over once idle
+            self._virtual_time = 0.0
+            self._last_tag.clear()
+        finally:
+            self._dispatcher = None
+
+    def get_stats(self) -> dict:
+        """Queue depth per client, for /api/health"""
+        return {
+            "queued": dict(self._queued),
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "max_queue": self.max_queue
+        }
+
+# Global scheduler instance
+scheduler = FairScheduler(
+    settings.SCHEDULER_WEIGHTS,
+    max_queue=settings.SCHEDULER_MAX_QUEUE,
+    requests_per_minute=settings.GEMINI_RPM
+)
+
+metrics.Gauge(
+    "chimera_scheduler_queued", "Requests waiting for their fair share of the quota",
+    function=lambda: {(): sum(scheduler._queued.values())}
+)
+metrics.Counter(
+    "chimera_scheduler_requests_total", "Requests granted a slot or turned away", ("result",),
+    function=lambda: {("granted",): scheduler.granted, ("rejected",): scheduler.rejected}
+)
@@ -0,0 +1,124 @@
+"""
+Full-text search over message history
+
+Backed by the messages_fts FTS5 index (see migration 5), which triggers
+keep in sync with the messages table. Results are ranked by BM25 and
+keyset-paginated on (rank, message id).
+
+The cursor is best effort: BM25 scores depend on corpus statistics, so
+messages added or deleted between pages shift the ranks and a later page
+can skip or repeat hits. Every page also scores all matches again before
+the cursor filter applies, so deep pages of a broad query cost as much
+as the first.
+"""
+import base64
+import html
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import column, func, literal_column, select, table, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import Conversation, Message
+
+# Words of context around the best match in a snippet
+SNIPPET_TOKENS = 16
+
+# Match markers, swapped for <mark> tags once the snippet is HTML-escaped
+_MATCH_START = "\x02"
+_MATCH_END = "\x03"
+
+_messages_fts = table("messages_fts", column("rowid"))
+_fts = literal_column("messages_fts")
+
+class InvalidSearch(ValueError):
+    """A query or cursor that cannot be searched for; routes answer 400"""
+
+def build_match_query(text: str) -> str:
+    """
+    Turn user input into an FTS5 query that matches every word
+    Words are quoted so FTS5 operators and punctuation are taken
+    literally; a trailing * keeps its meaning as a prefix search.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if not re.search(r"\w", word):
+            continue
+        terms.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+    if not terms:
+        raise InvalidSearch("Search query has no words to match")
+    return " ".join(terms)
+
+def _encode_cursor(rank: float, message_id: int) -> str:
+    """Opaque keyset cursor for the next page of results"""
+    return base64.urlsafe_b64encode(f"{rank!r}|{message_id}".encode()).decode()
+
+def _decode_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        rank, message_id = raw.rsplit("|", 1)
+        return float(rank), int(message_id)
+    except ValueError:
+        raise InvalidSearch("Invalid cursor")
+
+def _highlight(snippet: str) -> str:
+    """HTML-escape a snippet and mark up the matched words"""
+    return html.escape(snippet).replace(_MATCH_START, "<mark>").replace(_MATCH_END, "</mark>")
+
+async def search_messages(db: AsyncSession, text: str, limit: int = 20, cursor: Optional[str] = None,
+                          conversation_id: Optional[int] = None, since: Optional[datetime] = None,
+                          until: Optional[datetime] = None) -> Tuple[List[dict], Optional[str]]:
+    """
+    Find messages matching every word of text, best match first
+    Optionally only in one conversation, or created in [since, until).
+    Returns (results, cursor for the next page or None); see the module
+    docstring for the cursor's limits.
+    """
+    rank = func.bm25(_fts).label("rank")
+    query = (
+        select(
+            Message.id,
+            Message.conversation_id,
+            Conversation.title,
+            Message.role,
+            Message.created_at,
+            func.snippet(_fts, 0, _MATCH_START, _MATCH_END, "…", SNIPPET_TOKENS).label("snippet"),
+            rank
+        )
+        .select_from(_messages_fts)
+        .join(Message, Message.id == _messages_fts.c.rowid)
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .where(_fts.op("MATCH")(build_match_query(text)))
+        .order_by(rank, Message.id)
+        .limit(limit + 1)
+    )
+    if conversation_id is not None:
+        query = query.where(Message.conversation_id == conversation_id)
+    if since is not None:
+        query = query.where(Message.created_at >= since)
+    if until is not None:
+        query = query.where(Message.created_at < until)
+    if cursor:
+        last_rank, last_id = _decode_cursor(cursor)
+        query = query.where(tuple_(func.bm25(_fts), Message.id) > tuple_(last_rank, last_id))
+
+    rows = (await db.execute(query)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].rank, rows[-1].id)
+
+    return [
+        {
+            "message_id": row.id,
+            "conversation_id": row.conversation_id,
+            "conversation_title": row.title,
+            "role": row.role,
+            "snippet": _highlight(row.snippet),
+            "rank": row.rank,
+            "created_at": row.created_at
+        }
+        for row in rows
+    ], next_cursor
@@ -1,59 +1,484 @@
+import asyncio
+import hashlib
 import os
+import re
 import uuid
-from typing import List
-from fastapi import UploadFile
+from collections import Counter
+from datetime import datetime
+from typing import List, Optional
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.config import settings
-from app.utils.image_utils import resize_image
+from app.database import SessionLocal
+from app.models import Blob, Image as ImageModel, Message
+from app.utils import metrics
+from app.utils.image_utils import IMAGE_EXTENSIONS, detect_image_type, process_image, run_image_task
+from app.utils.payload_cache import image_payload_cache
 
-async def save_upload_file(upload_file: UploadFile) -> dict:
+# Uploads are streamed to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+_DIGEST = re.compile(r"[0-9a-f]{64}")
+
+def _check_image_type(mime_type: Optional[str], file_name: str) -> None:
     """
-    Save an uploaded file to the uploads directory
-    Returns file information
+    Reject content that is not one of the allowed image types (415)
+    """
+    if mime_type not in settings.ALLOWED_IMAGE_TYPES:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Unsupported image type for {file_name}. Allowed: JPEG, PNG, WebP, GIF"
+        )
+
+def _check_image_size(file_size: int, file_name: str) -> None:
+    """
+    Reject images over MAX_IMAGE_SIZE (413)
+    """
+    if file_size > settings.MAX_IMAGE_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image {file_name} exceeds the {settings.MAX_IMAGE_SIZE / (1024 * 1024):.1f}MB limit"
+        )
+
+async def _stream_to_disk(upload_file: UploadFile, file_path: str) -> dict:
     """
-    # Generate unique filename
-    file_extension = os.path.splitext(upload_file.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(settings.UPLOAD_DIR, unique_filename)
+    Stream an upload to disk chunk by chunk, enforcing the size limit and
+    validating the image type from its magic bytes
+    Returns the detected MIME type, size and SHA-256 of the upload
+    """
+    sha256 = hashlib.sha256()
+    file_size = 0
+    mime_type = None
+    
+    with open(file_path, "wb") as f:
+        while True:
+            chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            
+            if mime_type is None:
+                mime_type = detect_image_type(chunk)
+                _check_image_type(mime_type, upload_file.filename)
+            
+            file_size += len(chunk)
+            _check_image_size(file_size, upload_file.filename)
+            
+            sha256.update(chunk)
+            await asyncio.to_thread(f.write, chunk)
     
+    if mime_type is None:
+        raise HTTPException(status_code=400, detail=f"Image {upload_file.filename} is empty")
+    
+    return {"mime_type": mime_type, "file_size": file_size, "sha256": sha256.hexdigest()}
+
+def blob_path(digest: str, mime_type: str) -> str:
+    """
+    Content-addressed location of a blob inside the uploads directory
+    """
+    return os.path.join(settings.UPLOAD_DIR, digest[:2], f"{digest}{IMAGE_EXTENSIONS[mime_type]}")
+
+def thumbnail_path(digest: str, size: int) -> str:
+    """
+    Content-addressed location of a blob's WebP thumbnail
+    """
+    return os.path.join(settings.UPLOAD_DIR, "thumbs", str(size), digest[:2], f"{digest}.webp")
+
+def _existing_thumbnails(digest: str) -> dict:
+    """
+    Thumbnails already stored for a blob, by size
+    """
+    thumbnails = {}
+    for size in settings.THUMBNAIL_SIZES:
+        path = thumbnail_path(digest, size)
+        if os.path.exists(path):
+            thumbnails[str(size)] = path
+    return thumbnails
+
+def _blob_files(digest: str, file_path: str) -> List[str]:
+    """
+    Every file stored for a blob: the image and its thumbnails
+    """
+    return [file_path] + [thumbnail_path(digest, size) for size in settings.THUMBNAIL_SIZES]
+
+def _move_into_place(source_path: str, file_path: str) -> None:
+    """
+    Move a processed file to its content-addressed path, unless an
+    identical file is already there
+    """
+    if os.path.exists(file_path):
+        os.remove(source_path)
+    else:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(source_path, file_path)
+
+def _unlink(paths: List[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error deleting file {path}: {str(e)}")
+
+async def _lock_store(db: AsyncSession) -> None:
+    """
+    Take SQLite's write lock for the rest of the transaction
+    Content-addressed files are only moved into place, reused or unlinked
+    while it is held, which serialises those decisions with the blob
+    reference counts across all worker processes.
+    """
+    await db.execute(
+        update(Blob).where(Blob.id == -1).values(ref_count=Blob.ref_count),
+        execution_options={"synchronize_session": False}
+    )
+
+async def _take_reference(db: AsyncSession, file_info: dict) -> int:
+    """
+    Take one reference on the blob of a stored file, creating the blob if needed
+    Copies the blob's size and type into file_info, as an existing blob's
+    file may have been normalised differently. Returns the blob id
+    """
+    stmt = sqlite_insert(Blob).values(
+        digest=file_info["digest"],
+        source_digest=file_info["source_digest"],
+        file_path=file_info["file_path"],
+        mime_type=file_info["mime_type"],
+        file_size=os.path.getsize(file_info["file_path"]),
+        ref_count=1,
+        created_at=datetime.utcnow()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Blob.digest],
+        set_={"ref_count": Blob.ref_count + 1}
+    ).returning(Blob.id, Blob.file_size, Blob.mime_type)
+    blob_id, file_info["file_size"], file_info["mime_type"] = (await db.execute(stmt)).one()
+    return blob_id
+
+async def _claim(file_info: dict) -> bool:
+    """
+    Commit a reference on the blob behind a file before anything relies on it
+    Processed files listed in file_info["pending"] are moved into place
+    first; otherwise the stored file must still be there. Sets
+    file_info["blob_id"]. Returns False, without a reference, if there is
+    no file to refer to.
+    """
+    async with SessionLocal() as db:
+        await _lock_store(db)
+        if "pending" in file_info:
+            for source_path, file_path in file_info["pending"].items():
+                await asyncio.to_thread(_move_into_place, source_path, file_path)
+            del file_info["pending"]
+        elif not os.path.exists(file_info["file_path"]):
+            await db.rollback()
+            return False
+        # A reused file counts as new for the reaper's grace period
+        os.utime(file_info["file_path"])
+        file_info["blob_id"] = await _take_reference(db, file_info)
+        await db.commit()
+    return True
+
+async def release_files(saved_files: List[dict]) -> None:
+    """
+    Give back the blob references of saved files that ended up unused
+    (e.g. because the message that would have referenced them failed)
+    Files no other reference needs are unlinked before the release commits.
+    """
+    blob_ids = [file_info["blob_id"] for file_info in saved_files if "blob_id" in file_info]
+    if not blob_ids:
+        return
+    async with SessionLocal() as db:
+        await _lock_store(db)
+        paths = await release_blobs(db, blob_ids)
+        for path in paths:
+            image_payload_cache.discard(path)
+        await asyncio.to_thread(_unlink, paths)
+        await db.commit()
+
+async def remove_unreferenced_files(paths: List[str]) -> int:
+    """
+    Unlink files found unreferenced earlier (e.g. by a committed delete)
+    Content-addressed files whose blob has been referenced again since are
+    kept; the check and the unlink happen under the store lock. Returns
+    the number of files unlinked.
+    """
+    if not paths:
+        return 0
+    digests = {path: _digest_of(path) for path in paths}
+    async with SessionLocal() as db:
+        await _lock_store(db)
+        wanted = {digest for digest in digests.values() if digest}
+        if wanted:
+            stored = set(await db.scalars(select(Blob.digest).where(Blob.digest.in_(wanted))))
+            paths = [path for path in paths if digests[path] not in stored]
+        for path in paths:
+            image_payload_cache.discard(path)
+        await asyncio.to_thread(_unlink, paths)
+        await db.commit()
+    return len(paths)
+
+def _digest_of(path: str) -> Optional[str]:
+    """
+    Blob digest a content-addressed image or thumbnail is named after
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem if _DIGEST.fullmatch(stem) else None
+
+async def find_blob(db: AsyncSession, sha256: str) -> Optional[Blob]:
+    """
+    Find a stored blob for an upload, by normalised or source digest
+    """
+    result = await db.execute(
+        select(Blob).where(or_(Blob.digest == sha256, Blob.source_digest == sha256)).limit(1)
+    )
+    return result.scalar_one_or_none()
+
+async def _receive_upload(upload_file: UploadFile) -> dict:
+    """
+    Stream an upload into a temporary file in the uploads directory
+    Returns file information including the temporary path
+    """
     # Ensure upload directory exists
     os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
     
-    # Save file
-    contents = await upload_file.read()
-    with open(file_path, "wb") as f:
-        f.write(contents)
-    
-    # Get file size
-    file_size = len(contents)
+    temp_path = os.path.join(settings.UPLOAD_DIR, f".{uuid.uuid4()}.part")
+    try:
+        upload_info = await _stream_to_disk(upload_file, temp_path)
+    except BaseException:
+        delete_file(temp_path)
+        raise
     
-    # Resize if needed
+    return {
+        "file_name": upload_file.filename,
+        "mime_type": upload_info["mime_type"],
+        "file_size": upload_info["file_size"],
+        "source_digest": upload_info["sha256"],
+        "temp_path": temp_path
+    }
+
+async def _store_upload(file_info: dict) -> None:
+    """
+    Normalise a received upload in the image worker pool; the blob is keyed
+    by the digest of the result. The files are moved to their
+    content-addressed location when the blob is claimed.
+    """
+    temp_path = file_info["temp_path"]
+    output_path = f"{temp_path}.out"
+    digest = file_info["source_digest"]
+    thumbnails = {}
     try:
-        resize_image(file_path)
+        with metrics.stage_seconds.time(stage="image_process"):
+            result = await run_image_task(
+                process_image, temp_path, output_path, file_info["mime_type"],
+                settings.MAX_IMAGE_DIMENSION, settings.THUMBNAIL_SIZES
+            )
+        if result["digest"]:
+            digest = result["digest"]
+            os.replace(output_path, temp_path)
+        thumbnails = result["thumbnails"]
     except Exception as e:
         print(f"Warning: Could not resize image: {str(e)}")
+        delete_file(output_path)
     
-    return {
-        "file_path": file_path,
-        "file_name": upload_file.filename,
-        "mime_type": upload_file.content_type,
-        "file_size": file_size
+    file_path = blob_path(digest, file_info["mime_type"])
+    pending = {file_info.pop("temp_path"): file_path}
+    stored_thumbnails = {}
+    for size, path in thumbnails.items():
+        stored_thumbnails[str(size)] = thumbnail_path(digest, size)
+        pending[path] = stored_thumbnails[str(size)]
+    
+    file_info.update(file_path=file_path, digest=digest, thumbnails=stored_thumbnails, pending=pending)
+
+async def _claim_stored(file_info: dict, blob: Blob) -> bool:
+    """
+    Point a received upload at an identical stored blob and claim it, with
+    the blob's size and type. Returns False, leaving file_info as it was,
+    if the blob's file is gone.
+    """
+    reused = dict(file_info, digest=blob.digest, file_path=blob.file_path, file_size=blob.file_size,
+                  mime_type=blob.mime_type, thumbnails=_existing_thumbnails(blob.digest))
+    temp_path = reused.pop("temp_path")
+    if not await _claim(reused):
+        return False
+    delete_file(temp_path)
+    file_info.clear()
+    file_info.update(reused)
+    return True
+
+async def _store_received(received: List[dict], db: AsyncSession) -> None:
+    """
+    Store received files: duplicates reuse the stored blob, new images are
+    normalised and get thumbnails in the worker pool, in parallel. Each
+    file then holds a committed reference on its blob.
+    """
+    # Duplicate uploads reuse the stored blob and skip processing entirely
+    pending = []
+    for file_info in received:
+        blob = await find_blob(db, file_info["source_digest"])
+        if not blob or not await _claim_stored(file_info, blob):
+            pending.append(file_info)
+    
+    # Decode, resize and re-encode new images in parallel
+    await asyncio.gather(*[_store_upload(file_info) for file_info in pending])
+    for file_info in pending:
+        await _claim(file_info)
+        # Keep the ready-to-send encoding so Gemini calls never touch the file
+        await image_payload_cache.load(file_info["file_path"])
+
+async def _discard_received(received: List[dict]) -> None:
+    """
+    Remove what a failed _store_received() left behind: temporary files
+    and the blob references already claimed
+    """
+    for file_info in received:
+        for path in [file_info.get("temp_path"), *file_info.get("pending", {})]:
+            if path:
+                delete_file(path)
+    await release_files(received)
+
+async def save_multiple_files(files: List[UploadFile], db: AsyncSession) -> List[dict]:
+    """
+    Save multiple uploaded files, processing the images in parallel
+    Returns list of file information, each holding a committed reference on
+    its blob ("blob_id"); pass the list to release_files() if the rows that
+    were to reference them are not saved after all
+    """
+    received = []
+    try:
+        # Receive uploads one by one; this is I/O bound and bounded in memory
+        for file in files:
+            received.append(await _receive_upload(file))
+        await _store_received(received, db)
+    except BaseException:
+        # Don't leave files of a rejected batch behind
+        await _discard_received(received)
+        raise
+    return received
+
+async def store_image_bytes(data: bytes, file_name: str) -> dict:
+    """
+    Store image content from memory (e.g. from an import) like an upload
+    Subject to the same size and type checks, normalisation and
+    thumbnails. Returns file information holding a committed reference on
+    its blob, like save_multiple_files()
+    """
+    _check_image_size(len(data), file_name)
+    mime_type = detect_image_type(data[:16])
+    _check_image_type(mime_type, file_name)
+    
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    file_info = {
+        "file_name": file_name,
+        "mime_type": mime_type,
+        "file_size": len(data),
+        "source_digest": hashlib.sha256(data).hexdigest(),
+        "temp_path": os.path.join(settings.UPLOAD_DIR, f".{uuid.uuid4()}.part")
+    }
+    try:
+        await asyncio.to_thread(_write_file, file_info["temp_path"], data)
+        async with SessionLocal() as db:
+            await _store_received([file_info], db)
+    except BaseException:
+        await _discard_received([file_info])
+        raise
+    return file_info
+
+def _write_file(file_path: str, data: bytes) -> None:
+    """Write a file in one go, from a worker thread"""
+    with open(file_path, "wb") as f:
+        f.write(data)
+
+async def claim_stored_blob(digest: str, file_name: str) -> Optional[dict]:
+    """
+    Claim a blob already stored here, by content digest
+    Returns file information like save_multiple_files(), or None if there
+    is no such blob or its file is missing
+    """
+    async with SessionLocal() as db:
+        blob = await find_blob(db, digest)
+    if blob is None:
+        return None
+    file_info = {
+        "file_name": file_name,
+        "mime_type": blob.mime_type,
+        "file_size": blob.file_size,
+        "source_digest": blob.source_digest,
+        "digest": blob.digest,
+        "file_path": blob.file_path,
+        "thumbnails": _existing_thumbnails(blob.digest)
     }
+    return file_info if await _claim(file_info) else None
+
+async def release_blobs(db: AsyncSession, blob_ids: List[int]) -> List[str]:
+    """
+    Drop one reference per blob id and delete blobs that are no longer used
+    Returns the file paths (images and thumbnails) nothing references any more
+    """
+    if not blob_ids:
+        return []
+    
+    for blob_id, count in Counter(blob_ids).items():
+        await db.execute(
+            update(Blob).where(Blob.id == blob_id).values(ref_count=Blob.ref_count - count)
+        )
+    
+    result = await db.execute(
+        delete(Blob)
+        .where(Blob.id.in_(set(blob_ids)), Blob.ref_count <= 0)
+        .returning(Blob.digest, Blob.file_path)
+    )
+    return [path for digest, file_path in result for path in _blob_files(digest, file_path)]
 
-async def save_multiple_files(files: List[UploadFile]) -> List[dict]:
+async def release_conversation_blobs(db: AsyncSession, conversation_ids: List[int]) -> List[str]:
     """
-    Save multiple uploaded files
-    Returns list of file information
+    Set-based release_blobs() for every image in the given conversations
+    Call before the images are deleted. Returns the file paths to pass to
+    remove_unreferenced_files() once the caller has committed, including
+    legacy per-upload files.
     """
-    saved_files = []
-    for file in files:
-        file_info = await save_upload_file(file)
-        saved_files.append(file_info)
-    return saved_files
+    images = (
+        select(ImageModel.blob_id)
+        .join(Message, Message.id == ImageModel.message_id)
+        .where(Message.conversation_id.in_(conversation_ids))
+    )
+    released = (
+        select(func.count())
+        .select_from(ImageModel)
+        .join(Message, Message.id == ImageModel.message_id)
+        .where(ImageModel.blob_id == Blob.id, Message.conversation_id.in_(conversation_ids))
+        .correlate(Blob)
+        .scalar_subquery()
+    )
+    affected = images.where(ImageModel.blob_id.is_not(None))
+    
+    await db.execute(
+        update(Blob)
+        .where(Blob.id.in_(affected))
+        .values(ref_count=Blob.ref_count - released)
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(
+        delete(Blob)
+        .where(Blob.id.in_(affected), Blob.ref_count <= 0)
+        .returning(Blob.digest, Blob.file_path)
+    )
+    paths = [path for digest, file_path in result for path in _blob_files(digest, file_path)]
+    
+    # Legacy images own their file outright
+    legacy = await db.execute(
+        select(ImageModel.file_path)
+        .join(Message, Message.id == ImageModel.message_id)
+        .where(Message.conversation_id.in_(conversation_ids), ImageModel.blob_id.is_(None))
+    )
+    paths.extend(legacy.scalars())
+    return paths
 
 def delete_file(file_path: str) -> bool:
     """
     Delete a file from the filesystem
     """
+    image_payload_cache.discard(file_path)
     try:
         if os.path.exists(file_path):
             os.remove(file_path)
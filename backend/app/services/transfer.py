@@ -0,0 +1,284 @@
+"""
+Streaming NDJSON export and import of conversations
+
+An export is one JSON record per line, grouped by conversation: each
+conversation is followed by its messages, and each message by its images
+(see the Export* schemas). Conversations, messages and images are read
+through three server-side cursors on one connection and merged on the
+fly, so memory stays flat however large the database is.
+
+An import reads the same format line by line and writes it with bulk
+inserts, committing every IMPORT_CHUNK_SIZE records. Ids are remapped;
+images are restored from their exported content, or else linked to a
+blob with the same digest if this server already stores one.
+"""
+import asyncio
+import base64
+import binascii
+from collections import Counter
+from typing import Annotated, AsyncIterator, Dict, List, Optional, Tuple, Union
+from fastapi import HTTPException
+from pydantic import Field, TypeAdapter, ValidationError
+from sqlalchemy import insert, select
+from app.database import SessionLocal, engine
+from app.models import Blob, Conversation, Image as ImageModel, Message
+from app.schemas import ExportConversation, ExportImage, ExportMessage
+from app.services.storage import claim_stored_blob, release_files, store_image_bytes
+
+# Rows fetched per round trip from each export cursor
+EXPORT_FETCH_SIZE = 500
+
+# Records written per import transaction
+IMPORT_CHUNK_SIZE = 1000
+
+_records = TypeAdapter(Annotated[
+    Union[ExportConversation, ExportMessage, ExportImage], Field(discriminator="type")
+])
+
+class InvalidImport(ValueError):
+    """A malformed import; records before the failing chunk stay imported"""
+
+def _record_line(record) -> str:
+    return record.model_dump_json(exclude_none=True) + "\n"
+
+async def _stream(connection, query) -> AsyncIterator:
+    result = await connection.stream(query.execution_options(yield_per=EXPORT_FETCH_SIZE))
+    async for row in result:
+        yield row
+
+async def _next(rows: AsyncIterator):
+    """Next row of a cursor, or None once it is exhausted"""
+    try:
+        return await rows.__anext__()
+    except StopAsyncIteration:
+        return None
+
+def _read_file(file_path: str) -> bytes:
+    with open(file_path, "rb") as f:
+        return f.read()
+
+async def _image_data(file_path: str) -> Optional[str]:
+    """Base64 content of an image file, or None if it is missing"""
+    try:
+        data = await asyncio.to_thread(_read_file, file_path)
+    except OSError as e:
+        print(f"Warning: Could not export image {file_path}: {str(e)}")
+        return None
+    return base64.b64encode(data).decode()
+
+async def export_ndjson(conversation_ids: Optional[List[int]] = None,
+                        include_images: bool = False) -> AsyncIterator[str]:
+    """
+    Yield conversations, their messages and image metadata as NDJSON lines
+    Only the given conversations if conversation_ids is set; with
+    include_images, image records carry the file content in base64.
+    """
+    conversations = (
+        select(Conversation.id, Conversation.title, Conversation.created_at, Conversation.updated_at)
+        .order_by(Conversation.id)
+    )
+    messages = (
+        select(Message.id, Message.conversation_id, Message.role, Message.content, Message.created_at)
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .order_by(Message.conversation_id, Message.id)
+    )
+    images = (
+        select(
+            Message.conversation_id, ImageModel.message_id, ImageModel.file_name, ImageModel.mime_type,
+            ImageModel.file_size, ImageModel.file_path, ImageModel.created_at, Blob.digest
+        )
+        .join(Message, Message.id == ImageModel.message_id)
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .outerjoin(Blob, Blob.id == ImageModel.blob_id)
+        .order_by(Message.conversation_id, ImageModel.message_id, ImageModel.id)
+    )
+    if conversation_ids:
+        conversations = conversations.where(Conversation.id.in_(conversation_ids))
+        messages = messages.where(Conversation.id.in_(conversation_ids))
+        images = images.where(Conversation.id.in_(conversation_ids))
+
+    async with engine.connect() as connection:
+        message_rows = _stream(connection, messages)
+        image_rows = _stream(connection, images)
+        message = await _next(message_rows)
+        image = await _next(image_rows)
+
+        async for conversation in _stream(connection, conversations):
+            yield _record_line(ExportConversation(**conversation._mapping))
+
+            # Rows written between the cursors' snapshots are skipped
+            while message is not None and message.conversation_id < conversation.id:
+                message = await _next(message_rows)
+            while message is not None and message.conversation_id == conversation.id:
+                yield _record_line(ExportMessage(**message._mapping))
+
+                while (image is not None and
+                       (image.conversation_id, image.message_id) < (conversation.id, message.id)):
+                    image = await _next(image_rows)
+                while image is not None and image.message_id == message.id:
+                    yield _record_line(ExportImage(
+                        message_id=image.message_id,
+                        file_name=image.file_name,
+                        mime_type=image.mime_type,
+                        file_size=image.file_size,
+                        digest=image.digest,
+                        data=await _image_data(image.file_path) if include_images else None,
+                        created_at=image.created_at
+                    ))
+                    image = await _next(image_rows)
+
+                message = await _next(message_rows)
+
+def _parse_record(line: str, line_number: int):
+    """Parse one NDJSON line into its Export* record"""
+    try:
+        return _records.validate_json(line)
+    except ValidationError as e:
+        raise InvalidImport(f"Line {line_number}: {str(e)}")
+
+class _Importer:
+    """Buffers import records and writes them a chunk at a time"""
+
+    def __init__(self):
+        self.conversation_ids: Dict[int, int] = {}
+        # Old message id -> (new id, old conversation id); only messages of
+        # the current conversation are kept once their chunk is written
+        self.message_ids: Dict[int, Tuple[int, int]] = {}
+        self.current_conversation: Optional[int] = None
+        self.conversations: List[ExportConversation] = []
+        self.messages: List[Tuple[ExportMessage, int]] = []
+        self.images: List[Tuple[ExportImage, int]] = []
+        self.counts = Counter(conversations=0, messages=0, images=0, images_skipped=0)
+
+    @property
+    def pending(self) -> int:
+        return len(self.conversations) + len(self.messages) + len(self.images)
+
+    def add(self, record, line_number: int) -> None:
+        if isinstance(record, ExportConversation):
+            self.conversations.append(record)
+            self.current_conversation = record.id
+        elif isinstance(record, ExportMessage):
+            self.messages.append((record, line_number))
+        else:
+            self.images.append((record, line_number))
+
+    async def _image_file(self, record: ExportImage, line_number: int) -> Optional[dict]:
+        """Store or claim the file behind an image record; None if it cannot be restored"""
+        if record.data:
+            try:
+                data = base64.b64decode(record.data, validate=True)
+            except (binascii.Error, ValueError) as e:
+                raise InvalidImport(f"Line {line_number}: invalid image data: {str(e)}")
+            try:
+                return await store_image_bytes(data, record.file_name)
+            except HTTPException as e:
+                # Too large or not an allowed type, as for uploads
+                raise HTTPException(status_code=e.status_code, detail=f"Line {line_number}: {e.detail}")
+        if record.digest:
+            return await claim_stored_blob(record.digest, record.file_name)
+        return None
+
+    async def _write(self, db, images: List[Tuple[ExportImage, int, dict]]) -> None:
+        """Insert the buffered conversations and messages, and the claimed images"""
+        if self.conversations:
+            new_ids = (await db.execute(
+                insert(Conversation).returning(Conversation.id, sort_by_parameter_order=True),
+                [record.model_dump(include={"title", "created_at", "updated_at"})
+                 for record in self.conversations]
+            )).scalars().all()
+            for record, new_id in zip(self.conversations, new_ids):
+                self.conversation_ids[record.id] = new_id
+
+        if self.messages:
+            rows = []
+            for record, line_number in self.messages:
+                if record.conversation_id not in self.conversation_ids:
+                    raise InvalidImport(
+                        f"Line {line_number}: unknown conversation {record.conversation_id}"
+                    )
+                rows.append({
+                    "conversation_id": self.conversation_ids[record.conversation_id],
+                    "role": record.role,
+                    "content": record.content,
+                    "created_at": record.created_at
+                })
+            new_ids = (await db.execute(
+                insert(Message).returning(Message.id, sort_by_parameter_order=True), rows
+            )).scalars().all()
+            for (record, _), new_id in zip(self.messages, new_ids):
+                self.message_ids[record.id] = (new_id, record.conversation_id)
+
+        image_rows = []
+        for record, line_number, file_info in images:
+            if record.message_id not in self.message_ids:
+                raise InvalidImport(f"Line {line_number}: unknown message {record.message_id}")
+            image_rows.append({
+                "message_id": self.message_ids[record.message_id][0],
+                "blob_id": file_info["blob_id"],
+                "file_path": file_info["file_path"],
+                "file_name": file_info["file_name"],
+                "mime_type": file_info["mime_type"],
+                "file_size": file_info["file_size"],
+                "thumbnails": file_info["thumbnails"],
+                "created_at": record.created_at
+            })
+        if image_rows:
+            await db.execute(insert(ImageModel), image_rows)
+
+    async def flush(self) -> None:
+        """Write the buffered records in one transaction"""
+        if not self.pending:
+            return
+
+        # Image files are stored and claimed before the chunk's transaction
+        # takes the write lock; the claims are given back if it fails
+        saved_files = []
+        try:
+            images = []
+            for record, line_number in self.images:
+                file_info = await self._image_file(record, line_number)
+                if file_info is None:
+                    self.counts["images_skipped"] += 1
+                    continue
+                saved_files.append(file_info)
+                images.append((record, line_number, file_info))
+
+            async with SessionLocal() as db:
+                try:
+                    await self._write(db, images)
+                    await db.commit()
+                except BaseException:
+                    await db.rollback()
+                    raise
+        except BaseException:
+            await release_files(saved_files)
+            raise
+
+        self.counts["conversations"] += len(self.conversations)
+        self.counts["messages"] += len(self.messages)
+        self.counts["images"] += len(saved_files)
+        self.conversations, self.messages, self.images = [], [], []
+        self.message_ids = {
+            old_id: ids for old_id, ids in self.message_ids.items() if ids[1] == self.current_conversation
+        }
+
+async def import_ndjson(lines: AsyncIterator[str]) -> dict:
+    """
+    Import conversations from NDJSON lines in the export format
+    Lines must be grouped by conversation as export_ndjson() writes them.
+    Returns counts of the imported records. Raises InvalidImport on a bad
+    line, or HTTPException (413/415) on an image uploads would reject;
+    chunks before it stay committed.
+    """
+    importer = _Importer()
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        importer.add(_parse_record(line, line_number), line_number)
+        if importer.pending >= IMPORT_CHUNK_SIZE:
+            await importer.flush()
+    await importer.flush()
+    return dict(importer.counts)
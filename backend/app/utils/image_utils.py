@@ -1,36 +1,146 @@
+import asyncio
+import hashlib
+import multiprocessing
 import os
+from concurrent.futures import Executor, ProcessPoolExecutor
 from PIL import Image
 from io import BytesIO
+from typing import Optional, Tuple
 from app.config import settings
 
-def resize_image(image_path: str, max_dimension: int = None) -> None:
+# Leading bytes that identify each supported image format
+_IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+IMAGE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+}
+
+IMAGE_FORMATS = {
+    "image/jpeg": "JPEG",
+    "image/png": "PNG",
+    "image/gif": "GIF",
+    "image/webp": "WEBP",
+}
+
+def detect_image_type(header: bytes) -> Optional[str]:
     """
-    Resize image if it exceeds max_dimension while maintaining aspect ratio
+    Detect an image MIME type from its magic bytes
+    Returns None if the header does not match a supported format
     """
-    if max_dimension is None:
-        max_dimension = settings.MAX_IMAGE_DIMENSION
-    
-    try:
-        img = Image.open(image_path)
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime_type in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    return None
+
+def _fit_within(width: int, height: int, max_dimension: int):
+    """
+    Dimensions scaled down to fit max_dimension, maintaining aspect ratio
+    """
+    if width > height:
+        return max_dimension, int((max_dimension / width) * height)
+    return int((max_dimension / height) * width), max_dimension
+
+def _save_thumbnail(img: Image.Image, size: int, output_path: str) -> None:
+    """
+    Save a WebP thumbnail that fits within size x size
+    """
+    thumb = img.copy()
+    thumb.thumbnail((size, size), Image.Resampling.LANCZOS)
+    if thumb.mode not in ("RGB", "RGBA"):
+        thumb = thumb.convert("RGBA" if thumb.mode in ("LA", "P", "PA") else "RGB")
+    thumb.save(output_path, format="WEBP", quality=80, method=4)
+
+def process_image(source_path: str, output_path: str, mime_type: str, max_dimension: int,
+                  thumbnail_sizes: Tuple[int, ...] = ()) -> dict:
+    """
+    Decode an image once and, if it exceeds max_dimension, resize and
+    re-encode it to output_path (runs in the image worker pool)
+
+    JPEGs are decoded in draft mode, which lets libjpeg downscale by up to
+    8x while decoding instead of materialising the full-size bitmap.
+    Thumbnails for each of thumbnail_sizes are derived from the same decode
+    and written next to output_path as `<output_path>.<size>.webp`.
+    Returns the SHA-256 of the stored image (None if unchanged), its size
+    and the thumbnail paths by size.
+    """
+    with Image.open(source_path) as img:
+        width, height = img.size
+        needs_resize = width > max_dimension or height > max_dimension
+        if not needs_resize and not thumbnail_sizes:
+            return {"digest": None, "width": width, "height": height, "thumbnails": {}}
         
-        # Check if resizing is needed
-        if img.width > max_dimension or img.height > max_dimension:
-            # Calculate new dimensions maintaining aspect ratio
-            if img.width > img.height:
-                new_width = max_dimension
-                new_height = int((max_dimension / img.width) * img.height)
-            else:
-                new_height = max_dimension
-                new_width = int((max_dimension / img.height) * img.width)
-            
-            # Resize image
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Save back to the same path
-            img.save(image_path, optimize=True, quality=85)
-    except Exception as e:
-        print(f"Error resizing image {image_path}: {str(e)}")
-        raise
+        new_size = _fit_within(width, height, max_dimension) if needs_resize else (width, height)
+        if img.format == "JPEG":
+            img.draft(img.mode, new_size)
+        img.load()
+        
+        resized = img.resize(new_size, Image.Resampling.LANCZOS) if needs_resize else img.copy()
+    
+    digest = None
+    if needs_resize:
+        buffer = BytesIO()
+        resized.save(buffer, format=IMAGE_FORMATS[mime_type], optimize=True, quality=85)
+        data = buffer.getvalue()
+        with open(output_path, "wb") as f:
+            f.write(data)
+        digest = hashlib.sha256(data).hexdigest()
+    
+    thumbnails = {}
+    for size in thumbnail_sizes:
+        thumbnail_path = f"{output_path}.{size}.webp"
+        _save_thumbnail(resized, size, thumbnail_path)
+        thumbnails[size] = thumbnail_path
+    
+    return {
+        "digest": digest,
+        "width": resized.width,
+        "height": resized.height,
+        "thumbnails": thumbnails
+    }
+
+_image_executor: Optional[Executor] = None
+
+def start_image_executor() -> None:
+    """
+    Start the process pool for CPU-heavy image work, sized by IMAGE_WORKERS
+    Call at startup. Workers come from a forkserver (spawn where that is
+    unavailable), never from forking the threaded server process itself.
+    Without a pool, image work runs in a thread.
+    """
+    global _image_executor
+    if _image_executor is not None or settings.IMAGE_WORKERS <= 0:
+        return
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+    else:
+        context = multiprocessing.get_context("spawn")
+    _image_executor = ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS, mp_context=context)
+
+def shutdown_image_executor() -> None:
+    """Stop the image worker pool"""
+    global _image_executor
+    if _image_executor is not None:
+        _image_executor.shutdown(wait=False, cancel_futures=True)
+        _image_executor = None
+
+async def run_image_task(func, *args):
+    """
+    Run an image function off the event loop, in the worker pool if started
+    """
+    if _image_executor is None:
+        return await asyncio.to_thread(func, *args)
+    return await asyncio.get_running_loop().run_in_executor(_image_executor, func, *args)
 
 def get_image_info(file_path: str) -> dict:
     """
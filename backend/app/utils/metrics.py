@@ -0,0 +1,192 @@
+"""
+Minimal Prometheus metrics: counters, gauges and histograms
+
+Recording a sample is a dict lookup and an addition, cheap enough for the
+request path. Values that other components already track (cache hits,
+queue depths) are read by callbacks at scrape time instead.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Seconds; covers cache hits through rate limiter waits
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry: List["_Metric"] = []
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        """
+        Args:
+            name: Metric name
+            documentation: HELP text
+            labels: Label names, passed as keyword arguments when recording
+            function: Returns {label values: value} at scrape time, instead of recorded samples
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.function = function
+        self._values: Dict[Tuple[str, ...], float] = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self) -> List[str]:
+        values = self.function() if self.function else self._values
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {value}"
+            for key, value in values.items()
+        ]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the block takes, also when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{float(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+# Chat pipeline
+http_requests_in_flight = Gauge(
+    "chimera_http_requests_in_flight", "HTTP requests being handled", ("method",)
+)
+http_request_seconds = Histogram(
+    "chimera_http_request_seconds", "Time to handle an HTTP request", ("method", "route", "status")
+)
+stage_seconds = Histogram(
+    "chimera_chat_stage_seconds", "Time spent in each stage of handling a chat message", ("stage",)
+)
+
+# Gemini
+gemini_requests_in_flight = Gauge(
+    "chimera_gemini_requests_in_flight", "Upstream Gemini calls running", ("model",)
+)
+gemini_request_seconds = Histogram(
+    "chimera_gemini_request_seconds", "Duration of upstream Gemini calls", ("model", "outcome")
+)
+rate_limit_wait_seconds = Histogram(
+    "chimera_rate_limit_wait_seconds", "Time spent waiting for a rate limiter slot"
+)
+scheduler_wait_seconds = Histogram(
+    "chimera_scheduler_wait_seconds", "Time a request waited for its fair share of the quota"
+)
+quota_remaining = Gauge(
+    "chimera_quota_remaining", "Quota left across all workers, as of the last scrape", ("window",)
+)
+
+def observe_since_request_start(scope: dict, stage: str) -> None:
+    """Record the time from the request's arrival (see MetricsMiddleware) as a stage"""
+    started = scope.get("state", {}).get("metrics_started")
+    if started is not None:
+        stage_seconds.observe(time.perf_counter() - started, stage=stage)
+
+class MetricsMiddleware:
+    """ASGI middleware that times every HTTP request by route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        scope.setdefault("state", {})["metrics_started"] = started
+        method = scope["method"]
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc(method=method)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec(method=method)
+            # Route templates keep label values few, unlike raw paths
+            route = getattr(scope.get("route"), "path", "other")
+            http_request_seconds.observe(
+                time.perf_counter() - started, method=method, route=route, status=status
+            )
@@ -0,0 +1,122 @@
+"""
+Cache of encoded image parts ready to send to Gemini
+"""
+import asyncio
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from typing import List, Optional
+from app.config import settings
+from app.utils import metrics
+from app.utils.image_utils import IMAGE_EXTENSIONS
+
+# File extension -> MIME type
+_EXTENSION_TYPES = {extension: mime_type for mime_type, extension in IMAGE_EXTENSIONS.items()}
+_EXTENSION_TYPES[".jpeg"] = "image/jpeg"
+
+_DIGEST_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+class ImagePayloadCache:
+    """Size-bounded LRU cache of image parts, keyed by file and processing parameters"""
+    
+    def __init__(self, max_bytes: int):
+        """
+        Initialize payload cache
+        
+        Args:
+            max_bytes: Total size of cached image data before the least recently used entries are evicted
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def _key(self, file_path: str, max_dimension: Optional[int]) -> tuple:
+        if max_dimension is None:
+            max_dimension = settings.MAX_IMAGE_DIMENSION
+        return (os.path.normpath(file_path), max_dimension)
+    
+    def get(self, file_path: str, max_dimension: Optional[int] = None) -> Optional[dict]:
+        """Get a cached part, marking it as recently used"""
+        key = self._key(file_path, max_dimension)
+        part = self.entries.get(key)
+        if part is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return part
+    
+    def put(self, file_path: str, data: bytes, mime_type: Optional[str] = None,
+            max_dimension: Optional[int] = None) -> dict:
+        """Cache the encoded bytes of a processed image and return its part"""
+        if mime_type is None:
+            mime_type = _EXTENSION_TYPES.get(os.path.splitext(file_path)[1].lower(), "image/jpeg")
+        part = {"mime_type": mime_type, "data": data}
+        
+        if len(data) > self.max_bytes:
+            # Too big to cache at all
+            return part
+        
+        key = self._key(file_path, max_dimension)
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.total_bytes -= len(previous["data"])
+        
+        self.entries[key] = part
+        self.total_bytes += len(data)
+        
+        # Evict least recently used entries
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= len(evicted["data"])
+        return part
+    
+    def discard(self, file_path: str, max_dimension: Optional[int] = None) -> None:
+        """Drop a cached part, e.g. when its file is deleted"""
+        part = self.entries.pop(self._key(file_path, max_dimension), None)
+        if part is not None:
+            self.total_bytes -= len(part["data"])
+    
+    async def load(self, file_path: str) -> dict:
+        """
+        Get the part for a stored image, reading the file on a miss
+        The file already holds the processed encoding, so nothing is decoded
+        """
+        part = self.get(file_path)
+        if part is None:
+            data = await asyncio.to_thread(_read_file, file_path)
+            part = self.put(file_path, data)
+        return part
+    
+    async def digest(self, file_path: str) -> str:
+        """
+        SHA-256 of a stored image; content-addressed files carry it in their name
+        """
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        if _DIGEST_NAME.match(name):
+            return name
+        part = await self.load(file_path)
+        return hashlib.sha256(part["data"]).hexdigest()
+    
+    async def load_many(self, file_paths: List[str]) -> List[dict]:
+        """Get the parts for several stored images"""
+        return [await self.load(file_path) for file_path in file_paths]
+
+def _read_file(file_path: str) -> bytes:
+    with open(file_path, "rb") as f:
+        return f.read()
+
+# Global payload cache instance
+image_payload_cache = ImagePayloadCache(max_bytes=settings.IMAGE_PAYLOAD_CACHE_MB * 1024 * 1024)
+
+metrics.Counter(
+    "chimera_image_payload_cache_requests_total", "Encoded image cache lookups", ("result",),
+    function=lambda: {("hit",): image_payload_cache.hits, ("miss",): image_payload_cache.misses}
+)
+metrics.Gauge(
+    "chimera_image_payload_cache_bytes", "Encoded image bytes held in memory",
+    function=lambda: {(): image_payload_cache.total_bytes}
+)
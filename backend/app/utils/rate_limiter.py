@@ -1,59 +1,232 @@
 """
 Rate limiter to prevent exceeding Gemini API quotas
+
+Quota belongs to the API key, not to a process, so the limiter keeps its
+bookkeeping in a small SQLite file that every worker process on the host
+shares. Each reservation runs in a BEGIN IMMEDIATE transaction, which
+serializes workers without any coordinator process.
 """
+import asyncio
+import os
+import sqlite3
 import time
-from collections import deque
 from typing import Optional
+from app.config import settings
+from app.utils import metrics
+
+MINUTE = 60
+DAY = 24 * 60 * 60
+
+class QuotaRejected(Exception):
+    """A request was turned away rather than delayed; routes answer 429"""
+
+    def __init__(self, message: str, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(message)
+
+class QuotaExhausted(QuotaRejected):
+    """The daily request quota is used up; waiting a few seconds will not help"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(
+            f"Daily Gemini request quota exhausted. Try again in {retry_after / 3600:.1f} hours.",
+            retry_after
+        )
 
 class RateLimiter:
-    """Simple rate limiter for API calls"""
-    
-    def __init__(self, max_requests_per_minute: int = 15):
+    """Asyncio-aware rate limiter for API calls, shared across worker processes"""
+
+    def __init__(self, db_path: str, max_requests_per_minute: int = 15,
+                 max_requests_per_day: int = 0, max_tokens_per_minute: int = 0):
         """
         Initialize rate limiter
-        
+
         Args:
+            db_path: SQLite file shared by all workers using the same API key
             max_requests_per_minute: Maximum requests allowed per minute (default: 15 for free tier)
+            max_requests_per_day: Maximum requests in any 24 hours, 0 = unlimited
+            max_tokens_per_minute: Maximum tokens (prompt + response) per minute, 0 = unlimited
         """
+        self.db_path = db_path
         self.max_requests = max_requests_per_minute
-        self.requests = deque()
-        
-    def wait_if_needed(self) -> Optional[float]:
+        self.max_requests_per_day = max_requests_per_day
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection, creating the store on first use"""
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            connection.execute("PRAGMA journal_mode=WAL")
+            # slot is when a request may start and can lie in the future;
+            # rows with requests = 0 correct an earlier token estimate
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_events ("
+                "id INTEGER PRIMARY KEY, slot REAL NOT NULL, "
+                "requests INTEGER NOT NULL, tokens INTEGER NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_rate_events_slot ON rate_events (slot)")
+            self._initialized = True
+        return connection
+
+    def _check_day(self, connection: sqlite3.Connection, current_time: float) -> None:
+        """Raise QuotaExhausted if the last 24 hours used up the daily quota"""
+        if not self.max_requests_per_day:
+            return
+        used = connection.execute(
+            "SELECT COALESCE(SUM(requests), 0) FROM rate_events WHERE slot > ?",
+            (current_time - DAY,)
+        ).fetchone()[0]
+        if used >= self.max_requests_per_day:
+            # A request frees up when the oldest counted one turns a day old
+            oldest = connection.execute(
+                "SELECT slot FROM rate_events WHERE requests > 0 AND slot > ? "
+                "ORDER BY slot LIMIT 1 OFFSET ?",
+                (current_time - DAY, used - self.max_requests_per_day)
+            ).fetchone()[0]
+            raise QuotaExhausted(oldest + DAY - current_time)
+
+    def _check_daily_quota(self) -> None:
+        connection = self._connect()
+        try:
+            self._check_day(connection, time.time())
+        finally:
+            connection.close()
+
+    async def check_daily_quota(self) -> None:
+        """
+        Raise QuotaExhausted if the daily quota is used up, without reserving
+        anything; lets routes answer 429 before they start a response
         """
-        Check if we need to wait before making another request.
+        if self.max_requests_per_day:
+            await asyncio.to_thread(self._check_daily_quota)
+
+    def _reserve(self, tokens: int) -> float:
+        """
+        Reserve the earliest slot that keeps every window under its limit
+        Returns the slot time.
+        """
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                current_time = time.time()
+                connection.execute("DELETE FROM rate_events WHERE slot <= ?", (current_time - DAY,))
+
+                self._check_day(connection, current_time)
+
+                slot_time = current_time
+                recent = [row[0] for row in connection.execute(
+                    "SELECT slot FROM rate_events WHERE requests > 0 AND slot > ? "
+                    "ORDER BY slot DESC LIMIT ?",
+                    (current_time - MINUTE, self.max_requests)
+                )]
+                if len(recent) >= self.max_requests:
+                    slot_time = max(recent[-1] + MINUTE, recent[0])
+
+                if self.max_tokens_per_minute:
+                    window = connection.execute(
+                        "SELECT slot, tokens FROM rate_events WHERE slot > ? ORDER BY slot",
+                        (slot_time - MINUTE,)
+                    ).fetchall()
+                    used_tokens = sum(row_tokens for _, row_tokens in window)
+                    # Move the slot past the oldest events until the new request fits
+                    for row_slot, row_tokens in window:
+                        if used_tokens + tokens <= self.max_tokens_per_minute:
+                            break
+                        used_tokens -= row_tokens
+                        slot_time = max(slot_time, row_slot + MINUTE)
+
+                connection.execute(
+                    "INSERT INTO rate_events (slot, requests, tokens) VALUES (?, 1, ?)",
+                    (slot_time, tokens)
+                )
+                connection.execute("COMMIT")
+                return slot_time
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        finally:
+            connection.close()
+
+    async def wait_if_needed(self, tokens: int = 0) -> Optional[float]:
+        """
+        Wait (without blocking the event loop) until a request slot is free.
         Returns the number of seconds waited, or None if no wait was needed.
+        Raises QuotaExhausted at once if the daily quota is used up.
+
+        The slot is reserved before sleeping, so concurrent callers - in this
+        process or another worker - queue up behind each other instead of all
+        waking up for the same free slot.
+
+        Args:
+            tokens: Estimated tokens for the request, see record_tokens()
         """
-        current_time = time.time()
-        
-        # Remove requests older than 60 seconds
-        while self.requests and current_time - self.requests[0] > 60:
-            self.requests.popleft()
-        
-        # Check if we've hit the limit
-        if len(self.requests) >= self.max_requests:
-            # Calculate how long to wait
-            oldest_request = self.requests[0]
-            wait_time = 60 - (current_time - oldest_request)
-            
-            if wait_time > 0:
-                print(f"⏳ Rate limit reached. Waiting {wait_time:.1f} seconds...")
-                time.sleep(wait_time)
-                return wait_time
-        
-        # Record this request
-        self.requests.append(current_time)
+        slot_time = await asyncio.to_thread(self._reserve, tokens)
+
+        wait_time = slot_time - time.time()
+        metrics.rate_limit_wait_seconds.observe(max(0.0, wait_time))
+        if wait_time > 0:
+            print(f"⏳ Rate limit reached. Waiting {wait_time:.1f} seconds...")
+            await asyncio.sleep(wait_time)
+            return wait_time
         return None
-    
-    def get_remaining_requests(self) -> int:
-        """Get number of remaining requests in current window"""
-        current_time = time.time()
-        
-        # Remove old requests
-        while self.requests and current_time - self.requests[0] > 60:
-            self.requests.popleft()
-        
-        return max(0, self.max_requests - len(self.requests))
+
+    def _record_tokens(self, tokens: int) -> None:
+        connection = self._connect()
+        try:
+            connection.execute(
+                "INSERT INTO rate_events (slot, requests, tokens) VALUES (?, 0, ?)",
+                (time.time(), tokens)
+            )
+        finally:
+            connection.close()
+
+    async def record_tokens(self, tokens: int) -> None:
+        """
+        Correct the token count of a finished request
+        Pass the actual usage minus the estimate given to wait_if_needed().
+        """
+        if tokens and self.max_tokens_per_minute:
+            await asyncio.to_thread(self._record_tokens, tokens)
+
+    def _stats(self) -> dict:
+        connection = self._connect()
+        try:
+            current_time = time.time()
+            minute_requests, minute_tokens = connection.execute(
+                "SELECT COALESCE(SUM(requests), 0), COALESCE(SUM(tokens), 0) "
+                "FROM rate_events WHERE slot > ?",
+                (current_time - MINUTE,)
+            ).fetchone()
+            day_requests = connection.execute(
+                "SELECT COALESCE(SUM(requests), 0) FROM rate_events WHERE slot > ?",
+                (current_time - DAY,)
+            ).fetchone()[0]
+        finally:
+            connection.close()
+
+        stats = {
+            "requests_per_minute": self.max_requests,
+            "remaining_minute": max(0, self.max_requests - minute_requests),
+        }
+        if self.max_requests_per_day:
+            stats["requests_per_day"] = self.max_requests_per_day
+            stats["remaining_day"] = max(0, self.max_requests_per_day - day_requests)
+        if self.max_tokens_per_minute:
+            stats["tokens_per_minute"] = self.max_tokens_per_minute
+            stats["remaining_tokens_minute"] = max(0, self.max_tokens_per_minute - minute_tokens)
+        return stats
+
+    async def get_stats(self) -> dict:
+        """Remaining quota across all workers, for /api/health"""
+        return await asyncio.to_thread(self._stats)
 
 # Global rate limiter instance
-# Free tier: 15 RPM, Paid tier: 1000 RPM
-rate_limiter = RateLimiter(max_requests_per_minute=15)
+# Free tier: 15 RPM / 1,500 RPD, Paid tier: 1000 RPM
+rate_limiter = RateLimiter(
+    os.path.abspath(settings.RATE_LIMIT_DB),
+    max_requests_per_minute=settings.GEMINI_RPM,
+    max_requests_per_day=settings.GEMINI_RPD,
+    max_tokens_per_minute=settings.GEMINI_TPM
+)
@@ -0,0 +1,44 @@
+"""
+Static file serving for uploaded images
+"""
+import os
+import re
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+_DIGEST_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+class ImmutableStaticFiles(StaticFiles):
+    """
+    StaticFiles for files that never change once written
+
+    Uploads are stored under content-addressed (or random) names, so every
+    response gets a strong ETag and an immutable, year-long Cache-Control.
+    Conditional requests (If-None-Match / If-Modified-Since) get a 304.
+    """
+    
+    cache_control = "public, max-age=31536000, immutable"
+    
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        # In-progress uploads are dotfiles and must not be served
+        if os.path.basename(full_path).startswith("."):
+            raise HTTPException(status_code=404)
+        
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        response.headers["etag"] = f'"{self._etag(full_path, stat_result)}"'
+        response.headers["cache-control"] = self.cache_control
+        
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+    
+    @staticmethod
+    def _etag(full_path, stat_result: os.stat_result) -> str:
+        """Content digest for content-addressed files, else inode/size/mtime"""
+        name, extension = os.path.splitext(os.path.basename(full_path))
+        if _DIGEST_NAME.match(name):
+            return f"{name}{extension}"
+        return f"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"
@@ -0,0 +1,107 @@
+"""
+Benchmark upload image processing throughput.
+
+Compares the old pipeline (full decode, LANCZOS resize, save, one image at a
+time) with process_image() running in the image worker pool at increasing
+worker counts.
+
+Run from the backend directory:
+    python -m benchmarks.bench_image_processing --images 24 --size 4000x3000
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+from app.utils.image_utils import process_image
+
+def make_images(directory: str, count: int, width: int, height: int) -> list:
+    """Create synthetic photo-like JPEGs to process"""
+    base = Image.effect_mandelbrot((width, height), (-2.0, -1.2, 1.0, 1.2), 100).convert("RGB")
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    photo = Image.blend(base, noise, 0.3)
+    
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"source_{i}.jpg")
+        photo.save(path, quality=92)
+        paths.append(path)
+    return paths
+
+def legacy_resize(source_path: str, output_path: str, max_dimension: int) -> None:
+    """The original pipeline: full-size decode, resize, write back"""
+    img = Image.open(source_path)
+    if img.width > max_dimension or img.height > max_dimension:
+        if img.width > img.height:
+            new_size = (max_dimension, int((max_dimension / img.width) * img.height))
+        else:
+            new_size = (int((max_dimension / img.height) * img.width), max_dimension)
+        img = img.resize(new_size, Image.Resampling.LANCZOS)
+        img.save(output_path, format="JPEG", optimize=True, quality=85)
+
+def run_serial(func, paths: list, max_dimension: int) -> float:
+    start = time.perf_counter()
+    for path in paths:
+        func(path, f"{path}.out", max_dimension)
+    return time.perf_counter() - start
+
+def run_pool(paths: list, workers: int, max_dimension: int) -> float:
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Warm the pool up so process start-up is not measured
+        list(executor.map(abs, range(workers)))
+        
+        start = time.perf_counter()
+        futures = [
+            executor.submit(process_image, path, f"{path}.out", "image/jpeg", max_dimension)
+            for path in paths
+        ]
+        for future in futures:
+            future.result()
+        return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=24, help="Number of images to process")
+    parser.add_argument("--size", default="4000x3000", help="Source image size, WIDTHxHEIGHT")
+    parser.add_argument("--max-dimension", type=int, default=2048, help="Resize target")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1, help="Largest pool size to try")
+    args = parser.parse_args()
+    
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    directory = tempfile.mkdtemp(prefix="bench_images_")
+    
+    try:
+        print("=" * 60)
+        print(f"🖼️  Image processing benchmark: {args.images} x {width}x{height} JPEG -> {args.max_dimension}px")
+        print("=" * 60)
+        paths = make_images(directory, args.images, width, height)
+        
+        results = []
+        elapsed = run_serial(legacy_resize, paths, args.max_dimension)
+        results.append(("legacy, serial", elapsed))
+        
+        elapsed = run_serial(
+            lambda src, out, dim: process_image(src, out, "image/jpeg", dim), paths, args.max_dimension
+        )
+        results.append(("process_image, serial", elapsed))
+        
+        workers = 1
+        while workers <= args.max_workers:
+            results.append((f"process_image, {workers} worker(s)", run_pool(paths, workers, args.max_dimension)))
+            workers *= 2
+        if workers // 2 != args.max_workers:
+            results.append((f"process_image, {args.max_workers} worker(s)", run_pool(paths, args.max_workers, args.max_dimension)))
+        
+        baseline = results[0][1]
+        print(f"{'pipeline':<32}{'seconds':>10}{'images/s':>12}{'speedup':>10}")
+        for name, elapsed in results:
+            print(f"{name:<32}{elapsed:>10.2f}{args.images / elapsed:>12.1f}{baseline / elapsed:>9.1f}x")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Local stand-in for google.generativeai, for load tests that must not burn quota.
+
+Only the surface app/services/gemini.py uses is provided: configure() and
+GenerativeModel(name).generate_content_async(contents, stream=...). Latency
+is drawn from a log-normal distribution, and streamed replies arrive in
+chunks. Errors can be injected at chosen rates, worded like the real
+client's, so the model router and error mapping behave as in production.
+"""
+
+import asyncio
+import random
+import types
+from dataclasses import dataclass
+
+@dataclass
+class FakeGeminiConfig:
+    latency_ms: float = 800  # Median time to a full reply (or to the first chunk when streaming)
+    latency_sigma: float = 0.5  # Spread of the log-normal latency; 0 = always latency_ms
+    chunk_ms: float = 30  # Delay between streamed chunks
+    response_words: int = 120  # Length of each reply
+    chunk_words: int = 8  # Words per streamed chunk
+    error_rate: float = 0.0  # Share of calls failing with a transient server error
+    quota_error_rate: float = 0.0  # Share of calls failing with a 429 quota error
+    seed: int = None
+
+class _Usage:
+    def __init__(self, prompt_tokens: int, response_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = response_tokens
+        self.total_token_count = prompt_tokens + response_tokens
+
+class _Response:
+    def __init__(self, text: str, usage: _Usage):
+        self.text = text
+        self.usage_metadata = usage
+
+class _Stream:
+    """Async iterator of chunks, like the real streaming response"""
+
+    def __init__(self, model: "FakeGenerativeModel", words: list, usage: _Usage):
+        self._model = model
+        self._words = words
+        self.usage_metadata = usage
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        config = self._model.config
+        size = max(1, config.chunk_words)
+        for start in range(0, len(self._words), size):
+            if start:
+                await asyncio.sleep(config.chunk_ms / 1000)
+            yield _Response(" ".join(self._words[start:start + size]) + " ", None)
+
+def _prompt_tokens(contents) -> int:
+    if isinstance(contents, str):
+        return len(contents) // 4 + 1
+    tokens = 0
+    for content in contents:
+        for part in content["parts"]:
+            tokens += len(part) // 4 + 1 if isinstance(part, str) else 258
+    return tokens
+
+class FakeGenerativeModel:
+    """Drop-in for genai.GenerativeModel"""
+
+    config = FakeGeminiConfig()
+    random = random.Random()
+    calls = 0
+
+    def __init__(self, model_name: str, **kwargs):
+        self.model_name = model_name
+
+    def _latency(self) -> float:
+        config = self.config
+        if config.latency_sigma <= 0:
+            return config.latency_ms / 1000
+        return self.random.lognormvariate(0, config.latency_sigma) * config.latency_ms / 1000
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        FakeGenerativeModel.calls += 1
+        config = self.config
+        await asyncio.sleep(self._latency())
+
+        roll = self.random.random()
+        if roll < config.quota_error_rate:
+            raise Exception("429 Resource has been exhausted (e.g. check quota).")
+        if roll < config.quota_error_rate + config.error_rate:
+            raise Exception("503 The model is overloaded. Please try again later.")
+
+        words = [f"word{self.random.randrange(1000)}" for _ in range(config.response_words)]
+        usage = _Usage(_prompt_tokens(contents), config.response_words * 4 // 3)
+        if stream:
+            return _Stream(self, words, usage)
+        return _Response(" ".join(words), usage)
+
+def install(config: FakeGeminiConfig) -> None:
+    """
+    Make app.services.gemini talk to the fake instead of Google.
+    Call after importing the app; the real library is left untouched.
+    """
+    from app.services import gemini
+
+    FakeGenerativeModel.config = config
+    FakeGenerativeModel.random = random.Random(config.seed)
+    gemini.genai = types.SimpleNamespace(
+        configure=lambda **kwargs: None,
+        GenerativeModel=FakeGenerativeModel
+    )
@@ -0,0 +1,401 @@
+"""
+Load test the chat API offline, against a local Gemini stand-in.
+
+Starts the real FastAPI app in-process on a scratch database and upload
+directory, swaps google.generativeai for benchmarks.fake_gemini, seeds a
+large history and drives the endpoints over HTTP at a fixed concurrency.
+Reports throughput and p50/p95/p99 latency per scenario, and can write
+them as JSON to compare against a run from another commit.
+
+Needs httpx (pip install httpx). Run from the backend directory:
+    python -m benchmarks.load_test --requests 500 --concurrency 20 --output results.json
+    python -m benchmarks.load_test --scenarios list,detail --conversations 50000
+    python -m benchmarks.load_test --compare results.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+SCENARIOS = ("chat", "stream", "upload", "list", "detail", "messages")
+
+# Metrics compared by --compare, and whether a larger value is better
+COMPARED = (("throughput", True), ("p50", False), ("p95", False), ("p99", False))
+
+def configure_environment(directory: str, args) -> None:
+    """
+    Point the app at scratch storage and lift the real quota limits
+    Must run before anything from app is imported; settings read the
+    environment once.
+    """
+    os.environ.update({
+        "GEMINI_API_KEY": "fake-benchmark-key",
+        "GEMINI_RPM": "1000000",
+        "GEMINI_RPD": "0",
+        "GEMINI_TPM": "0",
+        "GEMINI_HEDGE_DELAY": "0",
+        "SCHEDULER_MAX_QUEUE": str(max(args.concurrency * 2, 20)),
+        "RESPONSE_CACHE_ENABLED": "false",
+        "JOB_WORKERS": "0",
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(directory, 'chat_history.db')}",
+        "RATE_LIMIT_DB": os.path.join(directory, "rate_limit.db"),
+        "UPLOAD_DIR": os.path.join(directory, "uploads"),
+    })
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def summarize(name: str, latencies: list, first_byte: list, errors: dict, elapsed: float) -> dict:
+    """
+    Throughput and latency percentiles (milliseconds) for one scenario
+    A scenario where every request errored is marked failed; its numbers
+    measure nothing.
+    """
+    latencies = sorted(latencies)
+    result = {
+        "scenario": name,
+        "requests": len(latencies) + sum(errors.values()),
+        "errors": errors,
+        "failed": bool(errors) and not latencies,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        "p50": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99": round(percentile(latencies, 0.99) * 1000, 2),
+        "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+    if first_byte:
+        first_byte = sorted(first_byte)
+        result["first_byte_p50"] = round(percentile(first_byte, 0.50) * 1000, 2)
+        result["first_byte_p95"] = round(percentile(first_byte, 0.95) * 1000, 2)
+    return result
+
+def make_images(count: int, width: int, height: int) -> list:
+    """Distinct JPEG uploads; content-addressed storage would dedupe repeats"""
+    from PIL import Image
+
+    images = []
+    for i in range(count):
+        noise = Image.effect_noise((width, height), 40 + i % 60).convert("RGB")
+        buffer = io.BytesIO()
+        noise.save(buffer, format="JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+async def seed_database(conversations: int, messages_per_conversation: int) -> list:
+    """
+    Bulk insert conversations with alternating user/assistant messages
+    Returns the new conversation ids.
+    """
+    from sqlalchemy import insert, select
+    from app.database import SessionLocal
+    from app.models import Conversation, Message
+
+    now = datetime.utcnow()
+    async with SessionLocal() as db:
+        for start in range(0, conversations, 1000):
+            batch = range(start, min(start + 1000, conversations))
+            await db.execute(insert(Conversation), [
+                {"title": f"Seeded conversation {i}",
+                 "created_at": now - timedelta(minutes=i), "updated_at": now - timedelta(minutes=i)}
+                for i in batch
+            ])
+        ids = list((await db.execute(select(Conversation.id).order_by(Conversation.id))).scalars())
+
+        rows = []
+        for conversation_id in ids:
+            for i in range(messages_per_conversation):
+                rows.append({
+                    "conversation_id": conversation_id,
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "content": f"Seeded message {i} " + "lorem ipsum " * 20,
+                })
+            if len(rows) >= 10000:
+                await db.execute(insert(Message), rows)
+                rows = []
+        if rows:
+            await db.execute(insert(Message), rows)
+        await db.commit()
+    return ids
+
+class Scenario:
+    """Builds and checks the requests for one endpoint"""
+
+    def __init__(self, name: str, args, conversation_ids: list, images: list):
+        self.name = name
+        self.args = args
+        self.conversation_ids = conversation_ids
+        self.images = images
+        self.random = random.Random(args.seed)
+        self.cursors = [None]
+
+    async def send(self, client, index: int):
+        """
+        Make request number index
+        Returns (seconds to first byte or None, error label or None).
+        """
+        if self.name == "chat":
+            response = await client.post("/api/chat/message", data={
+                "message": f"Benchmark question {index}", "use_cache": "false"
+            })
+            return None, self._error(response)
+
+        if self.name == "upload":
+            files = [
+                ("images", (f"image_{index}_{i}.jpg", self.images[(index + i) % len(self.images)], "image/jpeg"))
+                for i in range(self.args.images_per_message)
+            ]
+            response = await client.post(
+                "/api/chat/message",
+                data={"message": f"Describe these images {index}", "use_cache": "false"},
+                files=files
+            )
+            return None, self._error(response)
+
+        if self.name == "stream":
+            return await self._stream(client, index)
+
+        if self.name == "list":
+            # Walk the pages a client scrolling the sidebar would fetch
+            cursor = self.random.choice(self.cursors)
+            params = {"limit": 50}
+            if cursor:
+                params["cursor"] = cursor
+            response = await client.get("/api/chat/conversations", params=params)
+            next_cursor = response.headers.get("x-next-cursor")
+            if next_cursor and len(self.cursors) < 200:
+                self.cursors.append(next_cursor)
+            return None, self._error(response)
+
+        conversation_id = self.random.choice(self.conversation_ids)
+        if self.name == "detail":
+            response = await client.get(f"/api/chat/conversations/{conversation_id}")
+        else:
+            response = await client.get(f"/api/chat/conversations/{conversation_id}/messages",
+                                        params={"limit": 50})
+        return None, self._error(response)
+
+    async def _stream(self, client, index: int):
+        started = time.perf_counter()
+        first_byte = None
+        event = None
+        async with client.stream("POST", "/api/chat/message/stream", data={
+            "message": f"Benchmark question {index}", "use_cache": "false"
+        }) as response:
+            if response.status_code >= 400:
+                await response.aread()
+                return None, self._error(response)
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                    if event == "token" and first_byte is None:
+                        first_byte = time.perf_counter() - started
+        if event != "done":
+            return first_byte, f"stream_{event}"
+        return first_byte, None
+
+    @staticmethod
+    def _error(response):
+        return None if response.status_code < 400 else f"http_{response.status_code}"
+
+async def run_scenario(client, scenario: Scenario, requests: int, concurrency: int) -> dict:
+    """Send requests from concurrency workers as fast as they are answered"""
+    latencies, first_byte, errors = [], [], {}
+    counter = iter(range(requests))
+
+    async def worker():
+        for index in counter:
+            started = time.perf_counter()
+            try:
+                ttfb, error = await scenario.send(client, index)
+            except Exception as e:
+                ttfb, error = None, type(e).__name__
+            elapsed = time.perf_counter() - started
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+                continue
+            latencies.append(elapsed)
+            if ttfb is not None:
+                first_byte.append(ttfb)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(scenario.name, latencies, first_byte, errors, time.perf_counter() - started)
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+async def run(args) -> list:
+    import httpx
+    import uvicorn
+    from benchmarks import fake_gemini
+    from app.main import app
+
+    fake_gemini.install(fake_gemini.FakeGeminiConfig(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        chunk_ms=args.chunk_ms,
+        response_words=args.response_words,
+        error_rate=args.error_rate,
+        quota_error_rate=args.quota_error_rate,
+        seed=args.seed
+    ))
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        if serving.done():
+            serving.result()
+        await asyncio.sleep(0.05)
+
+    try:
+        print(f"🌱 Seeding {args.conversations} conversations x {args.messages} messages...")
+        started = time.perf_counter()
+        conversation_ids = await seed_database(args.conversations, args.messages)
+        print(f"   done in {time.perf_counter() - started:.1f}s")
+
+        images = make_images(args.image_pool, *args.image_size) if "upload" in args.scenarios else []
+
+        results = []
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits,
+                                     timeout=args.timeout) as client:
+            for name in args.scenarios:
+                scenario = Scenario(name, args, conversation_ids, images)
+                if args.warmup:
+                    await run_scenario(client, scenario, args.warmup, min(args.warmup, args.concurrency))
+                print(f"🏃 {name}: {args.requests} requests at concurrency {args.concurrency}")
+                results.append(await run_scenario(client, scenario, args.requests, args.concurrency))
+        return results
+    finally:
+        server.should_exit = True
+        await serving
+
+def print_results(results: list) -> None:
+    print(f"{'scenario':<10}{'requests':>10}{'errors':>8}{'req/s':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for result in results:
+        print(f"{result['scenario']:<10}{result['requests']:>10}{sum(result['errors'].values()):>8}"
+              f"{result['throughput']:>10.1f}{result['p50']:>10.1f}{result['p95']:>10.1f}"
+              f"{result['p99']:>10.1f}{result['max']:>10.1f}")
+    for result in results:
+        if result["failed"]:
+            print(f"❌ {result['scenario']}: every request failed ({result['errors']})")
+
+def print_comparison(results: list, baseline_path: str, threshold: float) -> bool:
+    """
+    Print each metric's change against an earlier run
+    Returns True if any metric got worse by more than threshold (a fraction).
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {result["scenario"]: result for result in baseline["results"]}
+
+    print(f"\n📊 Against {baseline_path} (commit {baseline.get('commit', 'unknown')})")
+    regressed = False
+    for result in results:
+        before = previous.get(result["scenario"])
+        if not before or result["failed"] or before.get("failed"):
+            continue
+        changes = []
+        for metric, higher_is_better in COMPARED:
+            if not before[metric]:
+                continue
+            change = (result[metric] - before[metric]) / before[metric]
+            worse = -change if higher_is_better else change
+            flag = " ⚠️" if worse > threshold else ""
+            regressed = regressed or worse > threshold
+            changes.append(f"{metric} {change:+.1%}{flag}")
+        print(f"{result['scenario']:<10}" + "  ".join(changes))
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated, from {','.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=10, help="Requests in flight at once")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests before each scenario")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout, seconds")
+    parser.add_argument("--conversations", type=int, default=10000, help="Conversations to seed")
+    parser.add_argument("--messages", type=int, default=20, help="Messages per seeded conversation")
+    parser.add_argument("--images-per-message", type=int, default=3, help="Images sent by the upload scenario")
+    parser.add_argument("--image-pool", type=int, default=32, help="Distinct images to upload")
+    parser.add_argument("--image-size", default="1600x1200", help="Upload size, WIDTHxHEIGHT")
+    parser.add_argument("--latency-ms", type=float, default=800, help="Median fake Gemini latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal spread, 0 = fixed")
+    parser.add_argument("--chunk-ms", type=float, default=30, help="Delay between streamed chunks")
+    parser.add_argument("--response-words", type=int, default=120, help="Words per fake reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls failing with a 503")
+    parser.add_argument("--quota-error-rate", type=float, default=0.0, help="Share of calls failing with a 429")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for latencies and request mix")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Regression tolerance for --compare")
+    args = parser.parse_args()
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    args.image_size = tuple(int(v) for v in args.image_size.lower().split("x"))
+
+    directory = tempfile.mkdtemp(prefix="bench_load_")
+    configure_environment(directory, args)
+    try:
+        print("=" * 60)
+        print(f"🔥 Load test, fake Gemini at {args.latency_ms:.0f}ms median (sigma {args.latency_sigma})")
+        print("=" * 60)
+        results = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print()
+    print_results(results)
+
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+    regressed = bool(args.compare) and print_comparison(results, args.compare, args.threshold)
+    if regressed or any(result["failed"] for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
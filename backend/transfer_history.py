@@ -0,0 +1,86 @@
+"""
+Back up or migrate chat history as NDJSON, straight from the database.
+
+Uses the same streaming export and chunked import as the
+/api/chat/export and /api/chat/import endpoints, so the server does not
+need to be running. Reads DATABASE_URL and UPLOAD_DIR from backend/.env.
+
+Run from the backend directory:
+    python transfer_history.py export backup.ndjson --images
+    python transfer_history.py export two.ndjson --conversation 3 --conversation 7
+    python transfer_history.py import backup.ndjson
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from fastapi import HTTPException
+
+from app.database import engine, init_db
+from app.services.transfer import InvalidImport, export_ndjson, import_ndjson
+
+async def export_history(output: str, conversation_ids: list, include_images: bool) -> None:
+    lines = 0
+    with open(output, "w", encoding="utf-8") as out:
+        async for line in export_ndjson(conversation_ids, include_images=include_images):
+            out.write(line)
+            lines += 1
+    print(f"✅ Exported {lines} records to {output}")
+
+async def _file_lines(path: str):
+    source = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line in source:
+            yield line
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+async def import_history(path: str) -> bool:
+    started = time.perf_counter()
+    try:
+        counts = await import_ndjson(_file_lines(path))
+    except (InvalidImport, HTTPException) as e:
+        print(f"❌ Import stopped: {e.detail if isinstance(e, HTTPException) else str(e)}")
+        print("   Chunks before the failing line were imported.")
+        return False
+    print(
+        f"✅ Imported {counts['conversations']} conversations, {counts['messages']} messages and "
+        f"{counts['images']} images in {time.perf_counter() - started:.1f}s"
+    )
+    if counts["images_skipped"]:
+        print(f"⚠️  {counts['images_skipped']} images had no content and no stored copy; "
+              "export with --images to include them")
+    return True
+
+async def run(args) -> bool:
+    try:
+        # Bring older databases up to the current schema first
+        await init_db()
+        if args.command == "export":
+            await export_history(args.output, args.conversation, args.images)
+            return True
+        return await import_history(args.input)
+    finally:
+        await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Write conversations as NDJSON")
+    export_parser.add_argument("output", help="File to write")
+    export_parser.add_argument("--conversation", type=int, action="append", help="Only this conversation (repeatable)")
+    export_parser.add_argument("--images", action="store_true", help="Embed image content in base64")
+
+    import_parser = commands.add_parser("import", help="Read conversations from an NDJSON export")
+    import_parser.add_argument("input", help="File to read, or - for stdin")
+
+    args = parser.parse_args()
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ import MessageInput from './MessageInput';
 
 const ChatInterface: React.FC = () => {
   const [conversations, setConversations] = useState<ConversationListItem[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [currentConversationId, setCurrentConversationId] = useState<number | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
   const [isLoading, setIsLoading] = useState(false);
@@ -26,15 +27,31 @@ const ChatInterface: React.FC = () => {
     }
   }, [currentConversationId]);
 
+  // Reload the first page; older conversations are fetched on demand
   const loadConversations = async () => {
     try {
-      const convs = await chatAPI.getConversations();
-      setConversations(convs);
+      const page = await chatAPI.getConversations();
+      setConversations(page.conversations);
+      setNextCursor(page.nextCursor);
     } catch (err) {
       console.error('Failed to load conversations:', err);
     }
   };
 
+  const loadMoreConversations = async () => {
+    if (!nextCursor) return;
+    try {
+      const page = await chatAPI.getConversations(nextCursor);
+      setConversations((prev) => [
+        ...prev,
+        ...page.conversations.filter((conv) => !prev.some((p) => p.id === conv.id)),
+      ]);
+      setNextCursor(page.nextCursor);
+    } catch (err) {
+      console.error('Failed to load more conversations:', err);
+    }
+  };
+
   const loadConversation = async (id: number) => {
     try {
       const conv = await chatAPI.getConversation(id);
@@ -152,6 +169,14 @@ const ChatInterface: React.FC = () => {
               </div>
             </div>
           ))}
+          {nextCursor && (
+            <button
+              onClick={loadMoreConversations}
+              className="w-full px-4 py-2 text-sm text-text-secondary hover:text-accent-cyan transition-colors"
+            >
+              Load more
+            </button>
+          )}
         </div>
       </div>
 
@@ -14,8 +14,10 @@ const ImagePreview: React.FC<ImagePreviewProps> = ({ images, onRemove, isUploade
     if (image instanceof File) {
       return URL.createObjectURL(image);
     } else {
-      // ImageInfo from API
-      return `http://localhost:8000/${image.file_path}`;
+      // ImageInfo from API - prefer the smallest thumbnail for previews
+      const sizes = Object.keys(image.thumbnails || {}).sort((a, b) => Number(a) - Number(b));
+      const path = sizes.length > 0 ? image.thumbnails![sizes[0]] : image.file_path;
+      return `http://localhost:8000/${path}`;
     }
   };
 
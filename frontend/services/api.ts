@@ -1,8 +1,11 @@
 import axios from 'axios';
-import { ChatResponse, Conversation, ConversationListItem } from '@/types';
+import { ChatResponse, Conversation, ConversationListItem, ConversationPage } from '@/types';
 
 const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000/api';
 
+// Conversations fetched per sidebar page
+const CONVERSATION_PAGE_SIZE = 50;
+
 const api = axios.create({
   baseURL: API_URL,
 });
@@ -36,10 +39,15 @@ export const chatAPI = {
     return response.data;
   },
 
-  // Get all conversations
-  getConversations: async (): Promise<ConversationListItem[]> => {
-    const response = await api.get<ConversationListItem[]>('/chat/conversations');
-    return response.data;
+  // Get a page of conversations, most recently updated first
+  getConversations: async (cursor?: string): Promise<ConversationPage> => {
+    const response = await api.get<ConversationListItem[]>('/chat/conversations', {
+      params: { limit: CONVERSATION_PAGE_SIZE, cursor },
+    });
+    return {
+      conversations: response.data,
+      nextCursor: response.headers['x-next-cursor'] || null,
+    };
   },
 
   // Get a specific conversation with all messages
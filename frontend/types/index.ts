@@ -4,6 +4,7 @@ export interface ImageInfo {
   file_name: string;
   mime_type: string;
   file_size?: number;
+  thumbnails?: Record<string, string> | null;
   created_at: string;
 }
 
@@ -32,6 +33,11 @@ export interface ConversationListItem {
   message_count: number;
 }
 
+export interface ConversationPage {
+  conversations: ConversationListItem[];
+  nextCursor: string | null;
+}
+
 export interface ChatResponse {
   user_message: Message;
   assistant_message: Message;